@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Several agents streaming to one collector over loopback: records sent vs notifications delivered."""
+
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from systemd_notifier.collector import Aggregator, start_server
+from systemd_notifier.notification import Notification, NotificationCenter
+from systemd_notifier.notifiers.collector import Collector
+
+class RecordingNotifier(object):
+
+    def __init__(self):
+        self.name          = "RecordingNotifier"
+        self.calls         = 0
+        self.notifications = []
+        self.last          = None
+
+    def notify_start(self, hostname):
+        pass
+
+    def notify_stop(self, hostname):
+        pass
+
+    def notify(self, notification):
+        self.notify_batch([notification])
+
+    def notify_batch(self, notifications):
+        self.calls += 1
+        self.notifications.extend(notifications)
+        self.last = time.time()
+
+def failure(hostname, unit_name):
+    return Notification.from_record({'hostname'     : hostname,
+                                     'unit'         : unit_name,
+                                     'service_type' : 'simple',
+                                     'states'       : [['active', 'running', 'loaded', 'enabled'],
+                                                       ['failed', 'failed', 'loaded', 'enabled']]})
+
+def agent(hostname, options, unit_names, repeats):
+    notifier = Collector(collections.defaultdict(str, options))
+    for _ in xrange(repeats):
+        for unit_name in unit_names:
+            notifier.notify(failure(hostname, unit_name))
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-a", "--agents", type = int, default = 200, help = "number of agents")
+    parser.add_argument("-u", "--units", type = int, default = 5, help = "units failing on every agent")
+    parser.add_argument("-r", "--repeats", type = int, default = 2, help = "times each agent reports each failure")
+    parser.add_argument("-w", "--window", type = float, default = 1.0, help = "collector aggregation window (seconds)")
+    parser.add_argument("--socket", help = "use this unix socket path instead of loopback TCP")
+    args = parser.parse_args()
+
+    recorder            = RecordingNotifier()
+    notification_center = NotificationCenter()
+    notification_center.add_notifier(recorder)
+    aggregator          = Aggregator(notification_center, window = args.window)
+    server              = start_server(aggregator, listen = '127.0.0.1:0', socket_path = args.socket)
+    options             = {'socket' : args.socket} if args.socket else {'address' : '127.0.0.1:%d'%(server.server_address[1])}
+
+    unit_names = ["app-%02d.service"%(i) for i in range(args.units)]
+    started    = time.time()
+    threads    = [threading.Thread(target = agent, args = ("node-%03d"%(i), options, unit_names, args.repeats))
+                  for i in range(args.agents)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sent = time.time()
+
+    records = args.agents * args.units * args.repeats
+    time.sleep(args.window * 2)
+    notification_center.join()
+
+    print "agents            %d"%(args.agents)
+    print "records sent      %d (%.0f records/s)"%(records, records / (sent - started))
+    print "notifier calls    %d"%(recorder.calls)
+    print "notifications     %d"%(len(recorder.notifications))
+    for notification in recorder.notifications[:3]:
+        print "  %s %s on %s"%(notification.unit.name, notification.unit.state_change.status_text, notification.hostname)
+    print "delivered after   %.3fs (window %.1fs)"%(recorder.last - started, args.window)
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""In-process stand-in for the subset of org.freedesktop.systemd1 that systemd_notifier uses.
+
+Pass a FakeSystemBus as the bus of a DBusManager to exercise the real
+DBusManager/DBusUnit code without systemd. Signals are delivered
+synchronously on the thread that changes a unit's state.
+"""
+
+import threading
+
+import dbus
+
+SYSTEMD_BUS_NAME = 'org.freedesktop.systemd1'
+SYSTEMD_PATH     = '/org/freedesktop/systemd1'
+UNIT_PATH_PREFIX = '/org/freedesktop/systemd1/unit/'
+
+IFACE_MANAGER = 'org.freedesktop.systemd1.Manager'
+IFACE_UNIT    = 'org.freedesktop.systemd1.Unit'
+IFACE_SERVICE = 'org.freedesktop.systemd1.Service'
+IFACE_PROPS   = 'org.freedesktop.DBus.Properties'
+
+def unit_path(unit_name):
+    escaped = ''.join(c if c.isalnum() else '_%02x'%(ord(c)) for c in unit_name)
+    return dbus.ObjectPath(UNIT_PATH_PREFIX + escaped)
+
+class FakeSignalMatch(object):
+
+    def __init__(self, bus, handler, signal_name, dbus_interface, path, path_keyword, arg0):
+        self._bus           = bus
+        self.handler        = handler
+        self.signal_name    = signal_name
+        self.dbus_interface = dbus_interface
+        self.path           = path
+        self.path_keyword   = path_keyword
+        self.arg0           = arg0
+
+    def matches(self, dbus_interface, signal_name, args):
+        return ((self.signal_name is None or self.signal_name == signal_name) and
+                (self.dbus_interface is None or self.dbus_interface == dbus_interface) and
+                (self.arg0 is None or (args and args[0] == self.arg0)))
+
+    def remove(self):
+        self._bus._remove_match(self)
+
+class FakeObject(object):
+
+    def __init__(self, bus, path):
+        self._bus = bus
+        self._path = path
+
+    @property
+    def object_path(self):
+        return self._path
+
+    def get_dbus_method(self, member, dbus_interface = None):
+        return getattr(self, member)
+
+    def connect_to_signal(self, signal_name, handler_function, dbus_interface = None, **keywords):
+        return self._bus.add_signal_receiver(handler_function, signal_name, dbus_interface, SYSTEMD_BUS_NAME, self._path, **keywords)
+
+class FakeUnit(FakeObject):
+
+    def __init__(self, bus, name, service_type = 'simple', active = 'active', sub = 'running',
+                 loaded = 'loaded', unit_file = 'enabled'):
+        super(FakeUnit, self).__init__(bus, unit_path(name))
+        self.name       = name
+        self.properties = {
+            IFACE_UNIT    : {'Id'            : dbus.String(name),
+                             'ActiveState'   : dbus.String(active),
+                             'SubState'      : dbus.String(sub),
+                             'LoadState'     : dbus.String(loaded),
+                             'UnitFileState' : dbus.String(unit_file)},
+            IFACE_SERVICE : {'Type' : dbus.String(service_type)} if name.endswith('.service') else {}
+        }
+        self.get_calls    = 0
+        self.getall_calls = 0
+
+    def Get(self, interface, name, dbus_interface = None):
+        self.get_calls += 1
+        return self.properties[interface][name]
+
+    def GetAll(self, interface, dbus_interface = None, reply_handler = None, error_handler = None):
+        self.getall_calls += 1
+        properties = dbus.Dictionary(self.properties.get(interface, {}), signature = 'sv')
+        if reply_handler is not None:
+            reply_handler(properties)
+            return None
+        return properties
+
+    def set_state(self, active, sub):
+        changed = {'ActiveState' : dbus.String(active), 'SubState' : dbus.String(sub)}
+        self.properties[IFACE_UNIT].update(changed)
+        self._bus.emit(self._path, IFACE_PROPS, 'PropertiesChanged',
+                       IFACE_UNIT, dbus.Dictionary(changed, signature = 'sv'), dbus.Array([], signature = 's'))
+
+    def set_unit_file_state(self, unit_file):
+        self.properties[IFACE_UNIT]['UnitFileState'] = dbus.String(unit_file)
+        self._bus.emit(dbus.ObjectPath(SYSTEMD_PATH), IFACE_MANAGER, 'UnitFilesChanged')
+
+    def listing(self):
+        props = self.properties[IFACE_UNIT]
+        return (dbus.String(self.name), dbus.String(''), props['LoadState'], props['ActiveState'],
+                props['SubState'], dbus.String(''), self._path, dbus.UInt32(0), dbus.String(''),
+                dbus.ObjectPath('/'))
+
+class FakeManager(FakeObject):
+
+    def __init__(self, bus):
+        super(FakeManager, self).__init__(bus, dbus.ObjectPath(SYSTEMD_PATH))
+
+    def Subscribe(self):
+        pass
+
+    def LoadUnit(self, name):
+        unit = self._bus.units.get(str(name))
+        if unit is None:
+            raise dbus.DBusException("Unit %s not found."%(name))
+        return unit.object_path
+
+    def ListUnits(self):
+        return [u.listing() for u in self._bus.units.values()]
+
+    def ListUnitsByNames(self, names):
+        return [self._bus.units[str(n)].listing() for n in names if str(n) in self._bus.units]
+
+    def ListUnitFiles(self):
+        return [(dbus.String('/lib/systemd/system/' + u.name), u.properties[IFACE_UNIT]['UnitFileState'])
+                for u in self._bus.units.values()]
+
+class FakeSystemBus(object):
+
+    def __init__(self):
+        self.units    = {}
+        self._paths   = {}
+        self._matches = {}
+        self._lock    = threading.Lock()
+        self._manager = FakeManager(self)
+
+    def add_unit(self, name, **kwargs):
+        unit = FakeUnit(self, name, **kwargs)
+        self.units[name]              = unit
+        self._paths[unit.object_path] = unit
+        self.emit(SYSTEMD_PATH, IFACE_MANAGER, 'UnitNew', dbus.String(name), unit.object_path)
+        return unit
+
+    def remove_unit(self, name):
+        unit = self.units.pop(name)
+        del self._paths[unit.object_path]
+        self.emit(SYSTEMD_PATH, IFACE_MANAGER, 'UnitRemoved', dbus.String(name), unit.object_path)
+
+    @property
+    def match_count(self):
+        return sum(len(m) for m in self._matches.values())
+
+    def get_object(self, bus_name, object_path, introspect = True, **kwargs):
+        if object_path == SYSTEMD_PATH:
+            return self._manager
+        return self._paths[object_path]
+
+    def get_name_owner(self, bus_name):
+        return ':1.1'
+
+    def add_signal_receiver(self, handler_function, signal_name = None, dbus_interface = None,
+                            bus_name = None, path = None, path_keyword = None, arg0 = None, **keywords):
+        match = FakeSignalMatch(self, handler_function, signal_name, dbus_interface, path, path_keyword, arg0)
+        with self._lock:
+            self._matches[path] = self._matches.get(path, []) + [match]
+        return match
+
+    def emit(self, path, dbus_interface, signal_name, *args):
+        for match in self._matches.get(path, []) + self._matches.get(None, []):
+            if match.matches(dbus_interface, signal_name, args):
+                if match.path_keyword:
+                    match.handler(*args, **{match.path_keyword : path})
+                else:
+                    match.handler(*args)
+
+    def _remove_match(self, match):
+        with self._lock:
+            remaining = [m for m in self._matches.get(match.path, []) if m is not match]
+            if remaining:
+                self._matches[match.path] = remaining
+            else:
+                self._matches.pop(match.path, None)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""End-to-end throughput, signal-to-notification latency and RSS against the fake systemd stand-in."""
+
+import argparse
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_systemd import FakeSystemBus
+from systemd_notifier import profiling
+from systemd_notifier.monitor import Monitor
+from systemd_notifier.notification import NotificationCenter
+from systemd_notifier.systemd import DBusManager
+
+class RecordingNotifier(object):
+
+    def __init__(self, expected):
+        self.name      = "RecordingNotifier"
+        self.emitted   = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.finished  = None
+        self._expected = expected
+        self._done     = threading.Event()
+
+    def notify_start(self, hostname):
+        pass
+
+    def notify_stop(self, hostname):
+        pass
+
+    def notify(self, notification):
+        now = time.time()
+        self.latencies.append(now - self.emitted[notification.unit.name].popleft())
+        if len(self.latencies) == self._expected:
+            self.finished = now
+            self._done.set()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def storm(fake_units, notifier, events, rate):
+    failed   = dict((u.name, False) for u in fake_units)
+    interval = 1.0 / rate if rate else 0
+    started  = time.time()
+    for i in xrange(events):
+        unit = fake_units[i % len(fake_units)]
+        failed[unit.name] = not failed[unit.name]
+        notifier.emitted[unit.name].append(time.time())
+        if failed[unit.name]:
+            unit.set_state('failed', 'failed')
+        else:
+            unit.set_state('active', 'running')
+        if interval:
+            time.sleep(max(0, started + (i + 1) * interval - time.time()))
+    return started
+
+def run(units, events, rate, cache_properties, shared_signals, engine, workers, callback_delay, profile_stages):
+    bus        = FakeSystemBus()
+    fake_units = [bus.add_unit("bench-%05d.service"%(i)) for i in xrange(units)]
+    notifier   = RecordingNotifier(events)
+
+    notification_center = NotificationCenter(workers = 1, queue_size = events + 1, overflow = 'block')
+    notification_center.add_notifier(notifier)
+
+    manager = DBusManager(cache_properties = cache_properties, shared_signals = shared_signals, bus = bus)
+    monitor = Monitor("bench", manager, notification_center, engine = engine, workers = workers)
+    monitor.register_units([u.name for u in fake_units])
+    if callback_delay:
+        monitor.on_each_state_change(lambda unit: time.sleep(callback_delay))
+
+    t = threading.Thread(target = monitor.start)
+    t.daemon = True
+    t.start()
+    while monitor.stats['states_enqueued'] < units or monitor.stats['queue_depth']:
+        time.sleep(0.01)
+
+    if profile_stages:
+        profiling.PROFILER.enable()
+    started = storm(fake_units, notifier, events, rate)
+    if not notifier.wait(600):
+        raise RuntimeError("Timed out waiting for notifications")
+    if profile_stages:
+        sys.stderr.write(profiling.PROFILER.summary() + "\n")
+
+    latencies = sorted(notifier.latencies)
+    return {'units'      : units,
+            'events'     : events,
+            'events_sec' : events / (notifier.finished - started),
+            'p50_ms'     : percentile(latencies, 50) * 1000,
+            'p90_ms'     : percentile(latencies, 90) * 1000,
+            'p99_ms'     : percentile(latencies, 99) * 1000,
+            'max_ms'     : latencies[-1] * 1000,
+            'rss_mb'     : rss_kb() / 1024.0}
+
+COLUMNS = ('units', 'events', 'events_sec', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'rss_mb')
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-u", "--units", type = int, nargs = '+', default = [10, 1000, 10000], help = "unit counts to benchmark")
+    parser.add_argument("-e", "--events", type = int, default = 20000, help = "state changes per run")
+    parser.add_argument("-r", "--rate", type = float, default = 0, help = "state changes per second (0 = as fast as possible)")
+    parser.add_argument("--cache-properties", action = 'store_true', help = "build states from the signal payload")
+    parser.add_argument("--shared-signals", action = 'store_true', help = "use one shared PropertiesChanged match")
+    parser.add_argument("--engine", default = 'threaded', choices = Monitor.ENGINES, help = "event engine")
+    parser.add_argument("-w", "--workers", type = int, default = 1, help = "state processing workers (threaded engine)")
+    parser.add_argument("--callback-delay", type = float, default = 0, help = "seconds a per-state callback blocks, to simulate slow inline work")
+    parser.add_argument("--profile-stages", action = 'store_true', help = "print per-stage timings to stderr")
+    parser.add_argument("--single", action = 'store_true', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run(args.units[0], args.events, args.rate, args.cache_properties, args.shared_signals, args.engine, args.workers, args.callback_delay, args.profile_stages)
+        print " ".join("%.2f"%(result[c]) for c in COLUMNS)
+        sys.stdout.flush()
+        os._exit(0)
+
+    print " ".join("%10s"%(c) for c in COLUMNS)
+    for units in args.units:
+        command = [sys.executable, os.path.abspath(__file__), '--single', '-u', str(units),
+                   '-e', str(args.events), '-r', str(args.rate), '--engine', args.engine,
+                   '-w', str(args.workers), '--callback-delay', str(args.callback_delay)]
+        if args.cache_properties:
+            command.append('--cache-properties')
+        if args.shared_signals:
+            command.append('--shared-signals')
+        if args.profile_stages:
+            command.append('--profile-stages')
+        values = subprocess.check_output(command).split()
+        print " ".join("%10s"%(v) for v in values)
+
+if __name__ == "__main__":
+    main()
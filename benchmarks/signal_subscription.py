@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Registration time, bus match rules and per-signal dispatch cost with per-unit vs. shared PropertiesChanged match rules.
+
+Runs against the fake systemd stand-in, so registration does not include
+the AddMatch round trip each per-unit rule costs on a real bus; the
+match rule count shows how many of those a real bus would see.
+"""
+
+import argparse
+import os
+import sys
+import time
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbus
+
+from fake_systemd import FakeSystemBus
+from systemd_notifier.systemd import DBusManager, DBusUnit
+
+def properties_changed(sub_state):
+    return (DBusUnit.IFACE_UNIT,
+            dbus.Dictionary({'SubState' : dbus.String(sub_state)}, signature = 'sv'),
+            dbus.Array([], signature = 's'))
+
+def run(shared_signals, unit_count, signals):
+    bus     = FakeSystemBus()
+    names   = [bus.add_unit("bench-%05d.service"%(i)).name for i in xrange(unit_count)]
+    manager = DBusManager(cache_properties = True, shared_signals = shared_signals, bus = bus)
+    units   = manager.fetch_units(names)
+    queue   = Queue.Queue()
+
+    started = time.time()
+    for unit in units:
+        unit.register_listener(queue)
+    registration = time.time() - started
+    matches      = bus.match_count
+
+    payloads = [properties_changed(('exited', 'running')[i % 2]) for i in xrange(2)]
+    started  = time.time()
+    for i in xrange(signals):
+        bus.emit(units[i % len(units)].path, DBusUnit.IFACE_PROPS, "PropertiesChanged", *payloads[(i // len(units)) % 2])
+    dispatch = time.time() - started
+
+    for unit in units:
+        unit.unregister_listener()
+    return len(units), matches, registration, dispatch / signals
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("-u", "--units", type = int, default = 1000, help = "units to register")
+    parser.add_argument("-s", "--signals", type = int, default = 20000, help = "signals to dispatch")
+    args = parser.parse_args()
+
+    print "%-10s %6s %8s %16s %18s"%("mode", "units", "matches", "registration (s)", "dispatch (us/sig)")
+    for label, shared in (("per-unit", False), ("shared", True)):
+        units, matches, registration, dispatch = run(shared, args.units, args.signals)
+        print "%-10s %6d %8d %16.3f %18.1f"%(label, units, matches, registration, dispatch * 1e6)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Messages/sec through SlackWebHook against a local HTTP stand-in, with and without connection pooling."""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from systemd_notifier.notifiers.slack import SlackWebHook
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize         = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+def start_server():
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    t = threading.Thread(target = server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+def run(url, messages, keep_alive):
+    webhook = SlackWebHook(url, 'bench', 'bench', '', '', keep_alive = keep_alive)
+    attach  = {'fallback' : 'bench', 'text' : 'bench', 'color' : 'good'}
+
+    started = time.time()
+    for _ in xrange(messages):
+        webhook.ping("benchmark message", attachments = [attach])
+    elapsed = time.time() - started
+    webhook.pool.close()
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-n", "--messages", type = int, default = 2000, help = "messages per run")
+    args = parser.parse_args()
+
+    server = start_server()
+    url    = "http://127.0.0.1:%d/services/bench"%(server.server_address[1])
+
+    for label, keep_alive in (("without pooling", False), ("with pooling", True)):
+        print "%-16s %10.1f msgs/sec"%(label, run(url, args.messages, keep_alive))
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
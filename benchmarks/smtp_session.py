@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Notifications/sec through the Email notifier against a local smtpd stand-in, with and without a persistent session."""
+
+import argparse
+import asyncore
+import collections
+import os
+import smtpd
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from systemd_notifier.notification import Notification
+from systemd_notifier.notifiers.email import Email
+
+class StandInServer(smtpd.SMTPServer):
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.received = 0
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received += 1
+
+def start_server():
+    server = StandInServer()
+    t = threading.Thread(target = lambda: asyncore.loop(timeout = 0.01))
+    t.daemon = True
+    t.start()
+    return server
+
+def failure(i):
+    return Notification.from_record({'hostname'     : 'bench',
+                                     'unit'         : "bench-%05d.service"%(i),
+                                     'service_type' : 'simple',
+                                     'states'       : [['active', 'running', 'loaded', 'enabled'],
+                                                       ['failed', 'failed', 'loaded', 'enabled']]})
+
+def run(port, notifications, persistent, batch):
+    email = Email(collections.defaultdict(str, {'host' : '127.0.0.1', 'port' : port,
+                                                'from' : 'notifier@localhost', 'to' : 'ops@localhost'}))
+
+    started = time.time()
+    if batch > 1:
+        for i in xrange(0, len(notifications), batch):
+            email.notify_batch(notifications[i:i + batch])
+    else:
+        for notification in notifications:
+            email.notify(notification)
+            if not persistent:
+                email._session.close()
+    elapsed = time.time() - started
+    email._session.close()
+    return len(notifications) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-n", "--notifications", type = int, default = 1000, help = "notifications per run")
+    parser.add_argument("-b", "--batch", type = int, default = 50, help = "notifications per digest email")
+    args = parser.parse_args()
+
+    server        = start_server()
+    port          = server.socket.getsockname()[1]
+    notifications = [failure(i) for i in xrange(args.notifications)]
+
+    for label, persistent, batch in (("new session", False, 1),
+                                     ("persistent", True, 1),
+                                     ("digest x%d"%(args.batch), True, args.batch)):
+        print "%-16s %10.1f notifications/sec"%(label, run(port, notifications, persistent, batch))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Per-event StateChange classification cost: incremental vs. re-scanning the whole history."""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from systemd_notifier.state import State, StateChange
+
+class RescanStateChange(object):
+
+    def __init__(self):
+        self._states = []
+
+    def record_change(self, state):
+        self._states.append(state)
+
+    def diff(self):
+        zipped = zip(*(s.all_states for s in self._states))
+        return [states for states in zipped if not all(s.value == states[0].value for s in states)]
+
+    @property
+    def is_important(self):
+        if len(self._states) == 1:
+            return self._states[0].is_failure
+        return any(s[-1].is_important for s in self.diff())
+
+    @property
+    def is_restart(self):
+        return self._states[0].is_ok and self._states[-1].is_ok and any(s.active.value == 'deactivating' for s in self._states[1:])
+
+def flapping_states(events):
+    subs = ['running', 'reload', 'listening', 'running-degraded']
+    return [State('active', subs[i % len(subs)], 'loaded', 'enabled', 'simple') for i in xrange(events)]
+
+def run(factory, states):
+    state_change = factory()
+    started = time.time()
+    for state in states:
+        state_change.record_change(state)
+        state_change.is_important
+        state_change.is_restart
+    return len(states) / (time.time() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-n", "--events", type = int, nargs = '+', default = [100, 1000, 5000],
+                        help = "events per never-important unit")
+    args = parser.parse_args()
+
+    print "%8s %16s %16s"%("events", "rescan ev/s", "incremental ev/s")
+    for events in args.events:
+        states = flapping_states(events)
+        print "%8d %16.0f %16.0f"%(events, run(RescanStateChange, states), run(StateChange, states))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Notifications/sec through the generic Webhook notifier against a local HTTP stand-in."""
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from slack_webhook import start_server
+from systemd_notifier.notification import Notification
+from systemd_notifier.notifiers.webhook import Webhook
+
+def failure(i):
+    return Notification.from_record({'hostname'     : 'bench',
+                                     'unit'         : "bench-%05d.service"%(i),
+                                     'service_type' : 'simple',
+                                     'states'       : [['active', 'running', 'loaded', 'enabled'],
+                                                       ['failed', 'failed', 'loaded', 'enabled']]})
+
+def run(url, notifications, keep_alive, batch):
+    webhook = Webhook(collections.defaultdict(str, {'url' : url, 'keep_alive' : keep_alive}))
+
+    started = time.time()
+    if batch > 1:
+        for i in xrange(0, len(notifications), batch):
+            webhook.notify_batch(notifications[i:i + batch])
+    else:
+        for notification in notifications:
+            webhook.notify(notification)
+    elapsed = time.time() - started
+    webhook._endpoint.pool.close()
+    return len(notifications) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("-n", "--notifications", type = int, default = 2000, help = "notifications per run")
+    parser.add_argument("-b", "--batch", type = int, default = 50, help = "notifications per batched request")
+    args = parser.parse_args()
+
+    server        = start_server()
+    url           = "http://127.0.0.1:%d/hooks/bench"%(server.server_address[1])
+    notifications = [failure(i) for i in xrange(args.notifications)]
+
+    for label, keep_alive, batch in (("without pooling", False, 1),
+                                     ("with pooling", True, 1),
+                                     ("batched x%d"%(args.batch), True, args.batch)):
+        print "%-16s %10.1f notifications/sec"%(label, run(url, notifications, keep_alive, batch))
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from state import State
+
+class BaselineStore(object):
+
+    def __init__(self, path, flush_interval = 1.0):
+        self._path           = path
+        self._flush_interval = flush_interval
+        self._baselines      = self._load()
+        self._dirty          = threading.Event()
+        self._lock           = threading.Lock()
+
+        t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return len(self._baselines)
+
+    def get(self, unit_name):
+        values = self._baselines.get(unit_name)
+        if values is None:
+            return None
+        return State(*values)
+
+    def save(self, unit_name, state):
+        self._baselines[unit_name] = [v.value for v in state.all_states] + [state.type]
+        self._dirty.set()
+
+    def remove(self, unit_name):
+        if self._baselines.pop(unit_name, None) is not None:
+            self._dirty.set()
+
+    def retain(self, unit_names):
+        stale = [n for n in self._baselines if n not in unit_names]
+        for unit_name in stale:
+            del self._baselines[unit_name]
+        if stale:
+            logging.info("Dropped state baselines for %d units no longer monitored"%(len(stale)))
+            self._dirty.set()
+
+    def flush(self):
+        with self._lock:
+            self._dirty.clear()
+            baselines = dict(self._baselines)
+            tmp_path  = self._path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(baselines, f, separators = (',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(tmp_path, self._path)
+            except (IOError, OSError) as e:
+                logging.error("Failed to write unit state baselines to %s", self._path, exc_info=True)
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                baselines = json.load(f)
+        except (IOError, OSError) as e:
+            return {}
+        except ValueError as e:
+            logging.warning("Ignoring unreadable unit state baselines in %s", self._path)
+            return {}
+        logging.info("Loaded state baselines for %d units from %s"%(len(baselines), self._path))
+        return baselines
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self._flush_interval)
+            self.flush()
@@ -1,7 +1,14 @@
+import heapq
+import itertools
 import logging
+import Queue
+import time
 
 from collections import defaultdict
 
+import metrics
+import profiling
+
 from state import StateChange
 
 class keydefaultdict(defaultdict):
@@ -19,9 +26,9 @@ class keydefaultdict(defaultdict):
 
 class UnitWithState(object):
 
-    def __init__(self, unit):
+    def __init__(self, unit, original_state = None):
         self._unit         = unit
-        self._state_change = StateChange()
+        self._state_change = StateChange(original_state)
 
     @property
     def unit(self):
@@ -46,34 +53,153 @@ class UnitWithState(object):
     def record_change(self, state):
         self.state_change.record_change(state)
 
+    def snapshot(self):
+        snapshot = UnitWithState(self._unit)
+        snapshot._state_change = self._state_change
+        return snapshot
+
     def reset(self):
         logging.debug("%s start state: %s"%(self.unit, self.current_state))
         self._state_change = StateChange(self.current_state)
         
 class CallbackManager(object):
 
-    def __init__(self, queue):
-        self._queue  = queue
-        self._states = keydefaultdict(lambda u: UnitWithState(u))
+    def __init__(self, queue, debounce = 0, debounce_max = None, baselines = None):
+        self._queue        = queue
+        self._baselines    = baselines
+        self._states       = keydefaultdict(self._unit_with_state)
+        self._debounce     = debounce
+        self._debounce_max = debounce * 10 if debounce_max is None else debounce_max
+        self._pending      = {}
+        self._settling     = set()
+        self._deadlines    = []
+        self._sequence     = itertools.count()
+        self._busy_since   = None
+        self._latency      = 0
+        self._process_time = metrics.histogram('systemd_notifier_classification_seconds', "Time spent recording and classifying each state")
+
+    @property
+    def busy_for(self):
+        busy_since = self._busy_since
+        if busy_since is None:
+            return 0
+        return time.time() - busy_since
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
 
     def start(self, change_callback, each_state_change_callback):
         while True:
-            unit, state = self._queue.get()
-            logging.debug("%s new state: %s"%(unit, state))
-            unit_state = self._states[unit]
-            unit_state.record_change(state)
-
-            if each_state_change_callback:
-                try:
-                    each_state_change_callback(unit_state)
-                except Exception as e:
-                    logging.exception("Uncaught exception in callback: ", exc_info=True)
-
-            if change_callback and unit_state.state_change.is_important:
-                try:
-                    change_callback(unit_state)
-                except Exception as e:
-                    logging.exception("Uncaught exception in callback: ", exc_info=True)
-
-            if unit_state.state_change.is_important:
-                unit_state.reset()
+            try:
+                unit, state = self._queue.get(True, self.next_timeout())
+            except Queue.Empty:
+                unit, state = None, None
+            if state is not None and profiling.is_enabled():
+                profiling.record('queue_wait', state.created, unit.name)
+            self.process(unit, state, change_callback, each_state_change_callback)
+
+    def process(self, unit, state, change_callback, each_state_change_callback):
+        started = self._busy_since = time.time()
+        if state is not None:
+            self._latency = started - state.created
+            self._record(unit, state, each_state_change_callback)
+        elif unit is not None:
+            self._forget(unit, change_callback)
+        self._evaluate_settled(change_callback)
+        self._process_time.observe(time.time() - started)
+        if unit is not None:
+            profiling.record('classify', started, unit.name)
+        self._busy_since = None
+
+    def next_timeout(self):
+        if not self._deadlines:
+            return None
+        return max(0, self._deadlines[0][0] - time.time())
+
+    def _record(self, unit, state, each_state_change_callback):
+        logging.debug("%s new state: %s"%(unit, state))
+        unit_state = self._states[unit]
+        unit_state.record_change(state)
+        if self._baselines is not None and unit_state.state_change.count == 1:
+            self._baselines.save(unit_state.name, state)
+
+        if self._settle_baseline(unit, unit_state, state):
+            return
+
+        if each_state_change_callback:
+            try:
+                each_state_change_callback(unit_state)
+            except Exception as e:
+                logging.exception("Uncaught exception in callback: ", exc_info=True)
+
+        now         = time.time()
+        first_seen  = self._pending.get(unit, (now, None))[0]
+        deadline    = min(now + self._debounce, first_seen + self._debounce_max)
+        self._pending[unit] = (first_seen, deadline)
+        heapq.heappush(self._deadlines, (deadline, next(self._sequence), unit))
+
+    def _settle_baseline(self, unit, unit_state, state):
+        if unit_state.state_change.count == 1:
+            if getattr(unit, 'first_state_is_baseline', False):
+                logging.debug("%s baseline taken from first state: %s"%(unit, state))
+                self._settling.add(unit)
+                return True
+            return False
+
+        if unit not in self._settling:
+            return False
+        if state.active.value == 'failed':
+            self._settling.discard(unit)
+            return False
+        if state.is_ok:
+            self._settling.discard(unit)
+        logging.debug("%s baseline moved to: %s"%(unit, state))
+        unit_state.reset()
+        if self._baselines is not None:
+            self._baselines.save(unit_state.name, state)
+        return True
+
+    def _unit_with_state(self, unit):
+        if getattr(unit, 'first_state_is_baseline', False):
+            return UnitWithState(unit)
+        baseline = self._baselines.get(unit.name) if self._baselines is not None else None
+        if baseline is not None:
+            logging.debug("%s baseline state: %s"%(unit, baseline))
+        return UnitWithState(unit, baseline)
+
+    def _forget(self, unit, change_callback):
+        logging.debug("%s forgotten"%(unit))
+        if self._pending.pop(unit, None) is not None:
+            self._evaluate(self._states[unit], change_callback)
+        self._states.pop(unit, None)
+        self._settling.discard(unit)
+        if self._baselines is not None:
+            self._baselines.remove(unit.name)
+
+    def _evaluate_settled(self, change_callback):
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, unit = heapq.heappop(self._deadlines)
+            if self._pending.get(unit, (None, None))[1] != deadline:
+                continue
+            del self._pending[unit]
+            self._evaluate(self._states[unit], change_callback)
+
+    def _evaluate(self, unit_state, change_callback):
+        if not unit_state.state_change.is_important:
+            return
+
+        if change_callback:
+            try:
+                change_callback(unit_state)
+            except Exception as e:
+                logging.exception("Uncaught exception in callback: ", exc_info=True)
+
+        unit_state.reset()
+        if self._baselines is not None:
+            self._baselines.save(unit_state.name, unit_state.current_state)
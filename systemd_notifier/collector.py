@@ -0,0 +1,131 @@
+import hmac
+import json
+import logging
+import os
+import SocketServer
+import threading
+
+from collections import OrderedDict
+
+import metrics
+
+from notification import Notification, NotificationBatcher
+
+class GroupedNotification(Notification):
+
+    MAX_LISTED_HOSTS = 10
+
+    def __init__(self, notifications):
+        super(GroupedNotification, self).__init__(notifications[0].hostname, notifications[0].unit)
+        self._hostnames = sorted(set(n.hostname for n in notifications))
+
+    @property
+    def hostnames(self):
+        return self._hostnames
+
+    @property
+    def hostname(self):
+        if len(self._hostnames) == 1:
+            return self._hostnames[0]
+        listed = self._hostnames[:GroupedNotification.MAX_LISTED_HOSTS]
+        if len(self._hostnames) > len(listed):
+            listed.append("...")
+        return "%d hosts (%s)"%(len(self._hostnames), ", ".join(listed))
+
+class Aggregator(object):
+
+    def __init__(self, notification_center, window = 5, max_size = 0):
+        self._notification_center = notification_center
+        self._batcher             = NotificationBatcher(window, max_size, self._flush)
+        self._received            = metrics.counter('systemd_notifier_collector_records_total', "Notification records received from agents")
+        self._sent                = metrics.counter('systemd_notifier_collector_groups_total', "Grouped notifications sent after deduplication")
+
+    def add(self, notification):
+        self._received.inc()
+        self._batcher.add(notification)
+
+    def drain(self):
+        self._batcher.drain()
+
+    def _flush(self, notifications):
+        latest = OrderedDict()
+        for notification in notifications:
+            latest[(notification.hostname, notification.unit.name)] = notification
+
+        groups = OrderedDict()
+        for notification in latest.values():
+            key = (notification.unit.name, notification.type, notification.unit.state_change.status_text)
+            groups.setdefault(key, []).append(notification)
+
+        grouped = [GroupedNotification(g) for g in groups.values()]
+        logging.debug("Aggregated %d records into %d notifications", len(notifications), len(grouped))
+        self._sent.inc(len(grouped))
+        if len(grouped) == 1:
+            self._notification_center.notify(grouped[0])
+        else:
+            self._notification_center.notify_batch(grouped)
+
+class CollectorHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        max_size = self.server.max_record_size
+        if self.server.token is not None and not self._authenticate(self.rfile.readline(max_size + 1)):
+            logging.warning("Rejected unauthenticated connection from %s", self.client_address)
+            return
+
+        for line in iter(lambda: self.rfile.readline(max_size + 1), ""):
+            if len(line) > max_size:
+                logging.warning("Closing connection from %s: record exceeds %d bytes", self.client_address, max_size)
+                return
+            try:
+                record = json.loads(line)
+                kind   = record['kind']
+                if kind == 'notify':
+                    self.server.aggregator.add(Notification.from_record(record['notification']))
+                elif kind in ('start', 'stop'):
+                    logging.info("Agent on %s sent %s", record['hostname'], kind)
+                else:
+                    logging.warning("Ignoring record of unknown kind '%s' from %s", kind, self.client_address)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning("Ignoring unreadable record from %s", self.client_address, exc_info=True)
+
+    def _authenticate(self, line):
+        try:
+            record = json.loads(line)
+            return record['kind'] == 'auth' and hmac.compare_digest(str(record['token']), self.server.token)
+        except (KeyError, TypeError, ValueError) as e:
+            return False
+
+class TCPCollectorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class UnixCollectorServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+def start_server(aggregator, listen = None, socket_path = None, token = None, max_record_size = 65536):
+    if socket_path:
+        server = UnixCollectorServer(socket_path, CollectorHandler)
+        logging.info("Collecting notifications on unix socket %s"%(socket_path))
+    else:
+        host, _, port = (listen or '127.0.0.1:9754').rpartition(':')
+        server = TCPCollectorServer((host or '127.0.0.1', int(port)), CollectorHandler)
+        logging.info("Collecting notifications on %s:%d"%server.server_address)
+        if token is None and not server.server_address[0].startswith('127.'):
+            logging.warning("Collector listens on %s without a token; anyone who can connect can send notifications", server.server_address[0])
+    server.aggregator      = aggregator
+    server.token           = str(token) if token else None
+    server.max_record_size = max_record_size
+
+    t = threading.Thread(target = server.serve_forever)
+    t.daemon = True
+    t.start()
+    server.thread = t
+    return server
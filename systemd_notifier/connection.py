@@ -0,0 +1,127 @@
+import errno
+import httplib
+import logging
+import socket
+import threading
+import urlparse
+
+from error import NotifierError, NotifierPermanentError, NotifierRetryError
+
+class HTTPConnectionPool(object):
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def for_url(cls, url, timeout = 10, keep_alive = True):
+        parsed = urlparse.urlsplit(url)
+        key    = (parsed.scheme, parsed.netloc, timeout, keep_alive)
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(parsed.scheme, parsed.netloc, timeout, keep_alive)
+            return cls._pools[key]
+
+    def __init__(self, scheme, netloc, timeout = 10, keep_alive = True, max_idle = 4):
+        if scheme == 'https':
+            self._connection_class = httplib.HTTPSConnection
+        elif scheme == 'http':
+            self._connection_class = httplib.HTTPConnection
+        else:
+            raise NotifierError("Unsupported URL scheme '%s'"%(scheme))
+
+        self._netloc     = netloc
+        self._timeout    = timeout
+        self._keep_alive = keep_alive
+        self._max_idle   = max_idle
+        self._idle       = []
+        self._lock       = threading.Lock()
+
+    @property
+    def netloc(self):
+        return self._netloc
+
+    @property
+    def keep_alive(self):
+        return self._keep_alive
+
+    def post(self, url, body, headers):
+        parsed = urlparse.urlsplit(url)
+        path   = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        return self.request('POST', path, body, headers)
+
+    def request(self, method, path, body, headers):
+        connection, reused = self._acquire()
+        try:
+            response = self._send(connection, method, path, body, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            if not reused or not is_stale_connection_error(e):
+                raise NotifierError("Request to %s failed"%(self._netloc), e)
+            logging.debug("Kept-alive connection to %s went stale; reconnecting", self._netloc)
+            connection = self._connect()
+            try:
+                response = self._send(connection, method, path, body, headers)
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                raise NotifierError("Request to %s failed"%(self._netloc), e)
+
+        try:
+            data = response.read()
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            raise NotifierError("Request to %s failed"%(self._netloc), e)
+
+        if self._keep_alive and not response.will_close:
+            self._release(connection)
+        else:
+            connection.close()
+        return response.status, data, dict(response.getheaders())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _send(self, connection, method, path, body, headers):
+        headers = dict(headers)
+        headers['Connection'] = 'keep-alive' if self._keep_alive else 'close'
+        connection.request(method, path, body, headers)
+        return connection.getresponse()
+
+    def _connect(self):
+        return self._connection_class(self._netloc, timeout = self._timeout)
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+def is_stale_connection_error(error):
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    if isinstance(error, socket.timeout):
+        return False
+    return isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+def check_response(service, status, response, headers):
+    if status == 429 or status >= 500:
+        raise NotifierRetryError("%s returned HTTP %d: %s"%(service, status, response), retry_after(headers))
+    elif status >= 300:
+        raise NotifierPermanentError("%s returned HTTP %d: %s"%(service, status, response))
+
+def retry_after(headers):
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,97 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from error import NotifierPermanentError
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst = 1):
+        self._rate    = float(rate)
+        self._burst   = max(1, burst)
+        self._tokens  = float(self._burst)
+        self._updated = time.time()
+        self._lock    = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now           = time.time()
+                self._tokens  = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+class DeliveryPolicy(object):
+
+    def __init__(self, rate = 0, burst = 1, max_attempts = 1, backoff = 1, max_backoff = 60):
+        self.rate         = rate
+        self.burst        = burst
+        self.max_attempts = max(1, max_attempts)
+        self.backoff      = backoff
+        self.max_backoff  = max_backoff
+
+    def rate_limiter(self):
+        if self.rate > 0:
+            return TokenBucket(self.rate, self.burst)
+        return None
+
+    def retry_delay(self, attempt, error):
+        if isinstance(error, NotifierPermanentError) or attempt >= self.max_attempts:
+            return None
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return max(0, min(self.max_backoff, retry_after))
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(delay / 2.0, delay)
+
+class Outbox(object):
+
+    def __init__(self, path, max_entries = 1000):
+        self._path        = path
+        self._max_entries = max_entries
+        self._lock        = threading.Lock()
+        self._connection  = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS outbox ("
+                                 " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                                 " notifier TEXT NOT NULL,"
+                                 " record TEXT NOT NULL,"
+                                 " created REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS outbox_notifier ON outbox (notifier, id)")
+
+    @property
+    def path(self):
+        return self._path
+
+    def add(self, notifier, record):
+        with self._lock:
+            cursor = self._connection.execute("INSERT INTO outbox (notifier, record, created) VALUES (?, ?, ?)",
+                                              (notifier, json.dumps(record, separators = (',', ':')), time.time()))
+            trimmed = self._connection.execute("DELETE FROM outbox WHERE notifier = ? AND id <= "
+                                               "(SELECT id FROM outbox WHERE notifier = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                                               (notifier, notifier, self._max_entries)).rowcount
+            if trimmed > 0:
+                logging.warning("Outbox for %s is full; discarded %d oldest notifications.", notifier, trimmed)
+            return cursor.lastrowid
+
+    def remove(self, id):
+        with self._lock:
+            self._connection.execute("DELETE FROM outbox WHERE id = ?", (id,))
+
+    def pending(self, notifier):
+        with self._lock:
+            rows = self._connection.execute("SELECT id, record FROM outbox WHERE notifier = ? ORDER BY id",
+                                            (notifier,)).fetchall()
+        return [(id, json.loads(record)) for id, record in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
@@ -18,3 +18,12 @@ class NotifierDependencyError(Error):
 
 class NotifierError(Error):
     pass
+
+class NotifierRetryError(NotifierError):
+
+    def __init__(self, message, retry_after = None):
+        super(NotifierRetryError, self).__init__(message)
+        self.retry_after = retry_after
+
+class NotifierPermanentError(NotifierError):
+    pass
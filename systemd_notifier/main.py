@@ -2,29 +2,105 @@ def load_config(config_file):
     import yaml
 
     with open(config_file, 'r') as f:
-        return yaml.load(f)
+        return yaml.load(f, Loader = getattr(yaml, 'CLoader', yaml.Loader))
 
 def load_hostname(config):
     import socket
 
     return config.get('hostname', socket.gethostname())
 
+def load_metrics(config):
+    import metrics
+
+    options = config.get('metrics')
+    if not options:
+        return
+
+    metrics.enable()
+    metrics.start_server(listen = options.get('listen'), socket_path = options.get('socket'))
+
+def load_profiling(config):
+    import signal
+    import profiling
+
+    options  = config.get('profiling') or {}
+    profiler = profiling.configure(samples = options.get('samples', 10000),
+                                   slowest = options.get('slowest', 10))
+    if options.get('enabled'):
+        profiler.enable()
+    profiling.start_reporter(options.get('interval', 60))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiling.PROFILER.toggle())
+
 def load_dbus_manager(config):
     from systemd import DBusManager
 
-    return DBusManager()
+    return DBusManager(cache_properties = config.get('cache_properties', False),
+                       shared_signals   = config.get('shared_signals', False))
 
 def load_notification_center(config):
-    from collections import defaultdict
-    from notification import NotificationCenter, load_notifier
+    from notification import NotificationCenter
+    from delivery import DeliveryPolicy, Outbox
 
-    notification_center = NotificationCenter()
+    dispatch            = config.get('dispatch', {})
+    delivery            = config.get('delivery', {})
+    outbox              = Outbox(delivery['outbox'], delivery.get('outbox_max', 1000)) if delivery.get('outbox') else None
+    notification_center = NotificationCenter(workers      = dispatch.get('workers', 1),
+                                             queue_size   = dispatch.get('queue_size', 100),
+                                             overflow     = dispatch.get('overflow', 'drop-oldest'),
+                                             batch_window = dispatch.get('batch_window', 0),
+                                             batch_max    = dispatch.get('batch_max', 0),
+                                             delivery     = DeliveryPolicy(rate         = delivery.get('rate', 0),
+                                                                           burst        = delivery.get('burst', 1),
+                                                                           max_attempts = delivery.get('max_attempts', 1),
+                                                                           backoff      = delivery.get('backoff', 1),
+                                                                           max_backoff  = delivery.get('max_backoff', 60)),
+                                             outbox       = outbox)
 
+    return notification_center;
+
+def build_notifiers(config, current = None):
+    from collections import defaultdict
+    from notification import LazyNotifier
+
+    current   = current or {}
+    notifiers = {}
     for name, options in config.get('notifiers', {}).iteritems():
-        notifier = load_notifier(name)(defaultdict(str, options))
-        notification_center.add_notifier(notifier)
+        if name in current and current[name][0] == options:
+            notifiers[name] = current[name]
+        else:
+            notifiers[name] = (options, LazyNotifier(name, defaultdict(str, options)))
+    return notifiers
 
-    return notification_center;
+def apply_notifiers(notification_center, notifiers, current = None):
+    current = current or {}
+    for name, (_, notifier) in current.iteritems():
+        if name not in notifiers or notifiers[name][1] is not notifier:
+            notification_center.remove_notifier(notifier)
+    for name, (_, notifier) in notifiers.iteritems():
+        if name not in current or current[name][1] is not notifier:
+            notification_center.add_notifier(notifier, replay = not current)
+    return notifiers
+
+def load_notifiers(config, notification_center, current = None):
+    return apply_notifiers(notification_center, build_notifiers(config, current), current)
+
+def preload_notifiers(notifiers):
+    import logging
+    import os
+    import threading
+
+    def run():
+        for name, (_, notifier) in notifiers.iteritems():
+            try:
+                notifier.load()
+            except Exception:
+                logging.critical("Failed to load the %s notifier; exiting.", name, exc_info=True)
+                os._exit(1)
+
+    t = threading.Thread(target = run)
+    t.daemon = True
+    t.start()
+    return t
 
 def configure_logging(config):
     import logging
@@ -32,32 +108,201 @@ def configure_logging(config):
 
     logging.basicConfig(stream=sys.stderr, level=logging.INFO)
 
-def load_monitor(config, hostname, dbus_manager, notification_center):
+def load_baselines(config):
+    import atexit
+    from baseline import BaselineStore
+
+    if not config.get('state_file'):
+        return None
+
+    baselines = BaselineStore(config['state_file'], config.get('state_flush_interval', 1.0))
+    atexit.register(baselines.flush)
+    return baselines
+
+def load_trace(trace_file):
+    import atexit
+    import os
+    import signal
+    from recording import TraceWriter
+
+    if not trace_file:
+        return None
+
+    trace = TraceWriter(trace_file)
+    atexit.register(trace.close)
+
+    def close_and_terminate(signum, frame):
+        trace.close()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, close_and_terminate)
+    return trace
+
+def load_monitor(config, hostname, dbus_manager, notification_center, trace_file = None):
     from monitor import Monitor
 
-    monitor = Monitor(hostname, dbus_manager, notification_center)
+    monitor = Monitor(hostname, dbus_manager, notification_center,
+                      debounce     = config.get('debounce', 0),
+                      debounce_max = config.get('debounce_max'),
+                      engine       = config.get('engine', 'threaded'),
+                      baselines    = load_baselines(config),
+                      workers      = config.get('state_workers', 1),
+                      trace        = load_trace(trace_file))
 
     monitor.register_units(config.get('units', []))
 
     return monitor
+
+def load_watchdog(config, dbus_manager, monitor):
+    import atexit
+    from watchdog import Watchdog, sd_notify, watchdog_timeout
+
+    sd_notify("READY=1\nSTATUS=Monitoring")
+    atexit.register(sd_notify, "STOPPING=1")
+
+    timeout = watchdog_timeout()
+    if timeout is None:
+        return None
+
+    options = config.get('watchdog') or {}
+    return Watchdog(dbus_manager, monitor.callback_managers, timeout,
+                    max_latency = options.get('max_latency', 30),
+                    max_stall   = options.get('max_stall')).start()
+
+def run_collector(config, notification_center):
+    import atexit
+    import logging
+    import signal
+    import time
+    from collector import Aggregator, start_server
+    from watchdog import sd_notify, watchdog_timeout
+
+    options    = config['collector']
+    aggregator = Aggregator(notification_center,
+                            window   = options.get('window', 5),
+                            max_size = options.get('max_size', 0))
+    server     = start_server(aggregator,
+                              listen          = options.get('listen'),
+                              socket_path     = options.get('socket'),
+                              token           = options.get('token'),
+                              max_record_size = options.get('max_record_size', 65536))
+    sd_notify("READY=1\nSTATUS=Collecting")
+
+    atexit.register(notification_center.join, 10)
+    atexit.register(aggregator.drain)
+    signal.signal(signal.SIGHUP, lambda signum, frame: logging.warning("Collector mode does not reload its configuration; restart to apply changes."))
+
+    timeout = watchdog_timeout()
+    if timeout is not None:
+        logging.info("Petting the systemd watchdog every %.1fs while the collector server is running"%(timeout / 2.0))
+        while server.thread.is_alive():
+            sd_notify("WATCHDOG=1")
+            time.sleep(timeout / 2.0)
+        logging.error("Collector server stopped; withholding watchdog")
+        sd_notify("STATUS=Stalled: collector server stopped")
+    while True:
+        signal.pause()
+
+def reload_config(config_file, config, monitor, notification_center, notifiers):
+    import logging
+    from selector import UnitSelector
+
+    try:
+        new_config    = load_config(config_file)
+        selectors     = [UnitSelector(n) for n in new_config.get('units', [])]
+        new_notifiers = build_notifiers(new_config, notifiers)
+        for _, notifier in new_notifiers.itervalues():
+            notifier.load()
+    except Exception as e:
+        logging.error("Failed to reload configuration from %s; keeping the running configuration.", config_file, exc_info=True)
+        return config, notifiers
+
+    ignored = sorted(k for k in set(config) | set(new_config)
+                     if k not in ('units', 'notifiers') and config.get(k) != new_config.get(k))
+    if ignored:
+        logging.warning("Changes to %s take effect after a restart.", ", ".join(ignored))
+
+    monitor.update_units(selectors)
+    apply_notifiers(notification_center, new_notifiers, notifiers)
+    logging.info("Reloaded configuration from %s"%(config_file))
+    return new_config, new_notifiers
+
+def watch_config(config_file, config, dbus_manager, monitor, notification_center, notifiers):
+    import logging
+    import signal
+    from watchdog import sd_notify
+
+    running = [config, notifiers]
+    def do_reload():
+        sd_notify("RELOADING=1")
+        try:
+            running[:] = reload_config(config_file, running[0], monitor, notification_center, running[1])
+        except Exception:
+            logging.error("Failed to apply configuration from %s", config_file, exc_info=True)
+        finally:
+            sd_notify("READY=1")
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: dbus_manager.call_later(0, do_reload))
+
+def timed(timings, phase, function, *args):
+    import time
+
+    started = time.time()
+    result  = function(*args)
+    timings.append((phase, time.time() - started))
+    return result
+
+def report_startup(timings):
+    import sys
+
+    total = sum(seconds for _, seconds in timings)
+    sys.stderr.write("Startup profile:\n")
+    for phase, seconds in timings:
+        sys.stderr.write("  %-22s %8.1f ms %5.1f%%\n"%(phase, seconds * 1000, 100 * seconds / total if total else 0))
+    sys.stderr.write("  %-22s %8.1f ms\n"%("total", total * 1000))
     
 def main():
     import argparse
+    import sys
+
+    if sys.argv[1:2] == ['replay']:
+        from replay import main as replay
+        return replay(sys.argv[2:])
     
     parser = argparse.ArgumentParser(description="Notifier for systemd unit status changes")
     parser.add_argument("-c", "--config" , required=True, help="configuration file")
+    parser.add_argument("--profile-startup", action="store_true", help="print the time spent in each startup phase")
+    parser.add_argument("--record", metavar="TRACE", help="record every unit state to this trace file (see 'replay')")
 
-    args = parser.parse_args()
-    config              = load_config(args.config)
+    args    = parser.parse_args()
+    timings = []
+    config              = timed(timings, "load config", load_config, args.config)
 
     configure_logging(config)
     
+    timed(timings, "metrics", load_metrics, config)
+    load_profiling(config)
+
+    if config.get('collector'):
+        notification_center = load_notification_center(config)
+        preload_notifiers(load_notifiers(config, notification_center))
+        run_collector(config, notification_center)
+        return
+
     hostname            = load_hostname(config)
-    dbus_manager        = load_dbus_manager(config)
-    notification_center = load_notification_center(config)
+    dbus_manager        = timed(timings, "connect to D-Bus", load_dbus_manager, config)
+    notification_center = timed(timings, "notification center", load_notification_center, config)
+    notifiers           = timed(timings, "notifiers", load_notifiers, config, notification_center)
 
-    monitor             = load_monitor(config, hostname, dbus_manager, notification_center)
-    monitor.start()
+    monitor             = timed(timings, "fetch units", load_monitor, config, hostname, dbus_manager, notification_center, args.record)
+    watch_config(args.config, config, dbus_manager, monitor, notification_center, notifiers)
+    timed(timings, "attach listeners", monitor.attach)
+    preload_notifiers(notifiers)
+    load_watchdog(config, dbus_manager, monitor)
+    if args.profile_startup:
+        report_startup(timings)
+    monitor.run()
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,213 @@
+import bisect
+import BaseHTTPServer
+import logging
+import os
+import SocketServer
+import threading
+
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+def _format_labels(label_names, label_values, extra = ()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"'%(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + "}"
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+class NullMetric(object):
+
+    def inc(self, amount = 1, labels = ()):
+        pass
+
+    def observe(self, value, labels = ()):
+        pass
+
+NULL_METRIC = NullMetric()
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, help, label_names = ()):
+        self.name        = name
+        self.help        = help
+        self.label_names = label_names
+        self._values     = {}
+        self._lock       = threading.Lock()
+
+    def inc(self, amount = 1, labels = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels = ()):
+        return self._values.get(labels, 0)
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ["%s%s %s"%(self.name, _format_labels(self.label_names, l), _format_value(v)) for l, v in values]
+
+class Gauge(object):
+
+    type = 'gauge'
+
+    def __init__(self, name, help, function, label_names = ()):
+        self.name        = name
+        self.help        = help
+        self.label_names = label_names
+        self._function   = function
+
+    def lines(self):
+        value = self._function()
+        if not self.label_names:
+            value = {() : value}
+        return ["%s%s %s"%(self.name, _format_labels(self.label_names, l), _format_value(v)) for l, v in sorted(value.items())]
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names = (), buckets = DEFAULT_BUCKETS):
+        self.name        = name
+        self.help        = help
+        self.label_names = label_names
+        self.buckets     = tuple(buckets)
+        self._values     = {}
+        self._lock       = threading.Lock()
+
+    def observe(self, value, labels = ()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i]  += 1
+            counts[-1] += value
+
+    def lines(self):
+        with self._lock:
+            values = sorted((l, list(c)) for l, c in self._values.items())
+
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                lines.append("%s_bucket%s %d"%(self.name, _format_labels(self.label_names, labels, [('le', _format_value(bound))]), cumulative))
+            lines.append("%s_sum%s %s"%(self.name, _format_labels(self.label_names, labels), _format_value(counts[-1])))
+            lines.append("%s_count%s %d"%(self.name, _format_labels(self.label_names, labels), cumulative))
+        return lines
+
+class Registry(object):
+
+    def __init__(self):
+        self.enabled  = False
+        self._metrics = OrderedDict()
+        self._lock    = threading.Lock()
+
+    def counter(self, name, help, label_names = ()):
+        return self._register(Counter, name, help, label_names)
+
+    def histogram(self, name, help, label_names = (), buckets = DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, label_names, buckets)
+
+    def gauge(self, name, help, function, label_names = ()):
+        if not self.enabled:
+            return NULL_METRIC
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, function, label_names)
+            return self._metrics[name]
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP %s %s"%(metric.name, metric.help))
+            lines.append("# TYPE %s %s"%(metric.name, metric.type))
+            try:
+                lines.extend(metric.lines())
+            except Exception as e:
+                logging.error("Failed to collect metric %s", metric.name, exc_info=True)
+        return "\n".join(lines) + "\n"
+
+    def _register(self, cls, name, help, *args):
+        if not self.enabled:
+            return NULL_METRIC
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help, *args)
+            return self._metrics[name]
+
+REGISTRY = Registry()
+
+def enable():
+    REGISTRY.enabled = True
+
+def is_enabled():
+    return REGISTRY.enabled
+
+def counter(name, help, label_names = ()):
+    return REGISTRY.counter(name, help, label_names)
+
+def histogram(name, help, label_names = (), buckets = DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, label_names, buckets)
+
+def gauge(name, help, function, label_names = ()):
+    return REGISTRY.gauge(name, help, function, label_names)
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        logging.debug("metrics: " + format, *args)
+
+class TCPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+def start_server(listen = None, socket_path = None):
+    if socket_path:
+        server = UnixMetricsServer(socket_path, MetricsHandler)
+        logging.info("Serving metrics on unix socket %s"%(socket_path))
+    else:
+        host, _, port = (listen or '127.0.0.1:9753').rpartition(':')
+        server = TCPMetricsServer((host or '127.0.0.1', int(port)), MetricsHandler)
+        logging.info("Serving metrics on http://%s:%d/metrics"%server.server_address)
+
+    t = threading.Thread(target = server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
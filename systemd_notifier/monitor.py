@@ -2,33 +2,143 @@ import atexit
 import logging
 import Queue
 import threading
+import time
+
+import metrics
 
 from callback import CallbackManager
+from error import MonitorError
 from notification import NotificationCenter, Notification
+from selector import UnitSelector
+from recording import RecordingStateQueue
+
+class InlineStateQueue(object):
+
+    def __init__(self, process):
+        self._process = process
+
+    def put(self, item):
+        self._process(*item)
+
+    def qsize(self):
+        return 0
+
+class ShardedStateQueue(object):
+
+    def __init__(self, shards):
+        self._shards = [Queue.Queue() for _ in range(shards)]
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def put(self, item):
+        self._shards[hash(item[0].name) % len(self._shards)].put(item)
+
+    def qsize(self):
+        return sum(q.qsize() for q in self._shards)
 
 class Monitor(object):
 
-    def __init__(self, hostname, dbus_manager, notification_center):
+    ENGINES = ('threaded', 'mainloop')
+
+    def __init__(self, hostname, dbus_manager, notification_center, debounce = 0, debounce_max = None, engine = 'threaded', baselines = None, workers = 1, trace = None):
+        if engine not in Monitor.ENGINES:
+            raise MonitorError("Unknown engine '%s'. Expected one of %s"%(engine, ", ".join(Monitor.ENGINES)))
+        if workers > 1 and engine != 'threaded':
+            raise MonitorError("Multiple state workers require the 'threaded' engine")
+
         self._hostname                   = hostname
         self._dbus_manager               = dbus_manager
         self._notification_center        = notification_center
-        self._units                      = []
-        self._state_queue                = Queue.Queue()
-        self._callback_manager           = CallbackManager(self._state_queue)
+        self._units                      = {}
+        self._exact_names                = set()
+        self._selectors                  = []
+        self._watching                   = False
+        self._started                    = False
+        self._engine                     = engine
+        self._state_queue                = self._make_state_queue(engine, workers)
+        self._timer_deadline             = None
+        self._baselines                  = baselines
+        self._callback_managers          = [CallbackManager(q, debounce, debounce_max, baselines) for q in self._state_queues()]
+        if trace is not None:
+            self._state_queue            = RecordingStateQueue(self._state_queue, trace)
         self._change_callback            = lambda unit: self._unit_change_callback(unit)
         self._each_state_change_callback = None
+        metrics.gauge('systemd_notifier_state_queue_depth', "States waiting to be processed", self._state_queue.qsize)
+        metrics.gauge('systemd_notifier_monitored_units', "Units currently monitored", lambda: len(self._units))
+
+    @property
+    def callback_managers(self):
+        return self._callback_managers
+
+    @property
+    def stats(self):
+        return {'units'             : len(self._units),
+                'states_enqueued'   : sum(u.states_enqueued for u in self._units.values()),
+                'states_suppressed' : sum(u.states_suppressed for u in self._units.values()),
+                'queue_depth'       : self._state_queue.qsize(),
+                'notifiers'         : self._notification_center.stats}
 
     def add_notifier(self, notifier):
         self._notification_center.add_notifier(notifier)
 
     def register_unit(self, unit_name):
         unit = self._dbus_manager.fetch_unit(unit_name)
-        self._units.append(unit)
+        self._units[unit.name] = unit
+        self._exact_names.add(unit.name)
         return self
 
     def register_units(self, unit_names):
-        for unit_name in unit_names:
-            self.register_unit(unit_name)
+        started   = time.time()
+        selectors = [UnitSelector(n) for n in unit_names]
+        exact     = [s.pattern for s in selectors if s.is_exact]
+        patterns  = [s for s in selectors if not s.is_exact]
+
+        self._exact_names.update(exact)
+        if patterns:
+            self._watch_patterns(patterns)
+            matched = [n for n in self._dbus_manager.list_unit_names() if self._matches_pattern(n)]
+        else:
+            matched = []
+
+        names = [n for n in _unique(exact + matched) if n not in self._units]
+        units = self._dbus_manager.fetch_units(names)
+        for unit in units:
+            self._units[unit.name] = unit
+        logging.info("Fetched %d units in %.3fs"%(len(units), time.time() - started))
+        return self
+
+    def update_units(self, selectors):
+        started   = time.time()
+        exact     = set(s.pattern for s in selectors if s.is_exact)
+        patterns  = [s for s in selectors if not s.is_exact]
+
+        if patterns:
+            matched = [n for n in self._dbus_manager.list_unit_names() if any(s.matches(n) for s in patterns)]
+        else:
+            matched = []
+        wanted = exact.union(matched)
+        added  = self._dbus_manager.fetch_units(sorted(n for n in wanted if n not in self._units))
+
+        self._exact_names = exact
+        self._selectors   = []
+        if patterns:
+            self._watch_patterns(patterns)
+
+        removed = [n for n in self._units if n not in wanted]
+        for unit_name in removed:
+            self._detach(self._units.pop(unit_name))
+
+        if self._started:
+            self._dbus_manager.load_service_types(added)
+        for unit in added:
+            self._units[unit.name] = unit
+            if self._started:
+                unit.register_listener(self._state_queue)
+
+        logging.info("Updated units in %.3fs: %d added, %d removed, %d unchanged"%(
+            time.time() - started, len(added), len(removed), len(self._units) - len(added)))
         return self
 
     def on_change(self, callback):
@@ -40,24 +150,107 @@ class Monitor(object):
         return self
 
     def start(self):
+        self.attach()
+        self.run()
+
+    def attach(self):
         logging.info("Monitoring changes to %d units"%(len(self._units)))
-        logging.debug(" - " + "\n - ".join([u.name for u in self._units]) + "\n")
+        logging.debug(" - " + "\n - ".join([u.name for u in self._units.values()]) + "\n")
+
+        started = time.time()
+        self._started = True
+        if self._baselines is not None:
+            self._baselines.retain(self._units)
+        self._dbus_manager.load_service_types(self._units.values())
+        for unit in self._units.values():
+            unit.register_listener(self._state_queue)
+        if self._dbus_manager.cache_properties:
+            self._dbus_manager.on_unit_files_changed(self._unit_files_changed)
+        logging.info("Attached listeners to %d units in %.3fs"%(len(self._units), time.time() - started))
 
         atexit.register(lambda: self._notification_center.notify_stop(self._hostname))
         self._notification_center.notify_start(self._hostname)
+        return self
 
-        for unit in self._units:
-            unit.register_listener(self._state_queue)
-
-        threads = [self._start_callback_thread(), self._start_dbus_thread()]
+    def run(self):
+        if self._engine == 'threaded':
+            threads = [self._start_callback_thread(m) for m in self._callback_managers] + [self._start_dbus_thread()]
+        else:
+            threads = [self._start_dbus_thread()]
         for t in threads:
             t.join(1000000)
 
+    def _make_state_queue(self, engine, workers):
+        if engine == 'mainloop':
+            return InlineStateQueue(self._process_inline)
+        if workers > 1:
+            return ShardedStateQueue(workers)
+        return Queue.Queue()
+
+    def _state_queues(self):
+        if isinstance(self._state_queue, ShardedStateQueue):
+            return self._state_queue.shards
+        return [self._state_queue]
+
+    def _watch_patterns(self, selectors):
+        if not self._watching:
+            self._dbus_manager.on_unit_new(self._unit_new)
+            self._dbus_manager.on_unit_removed(self._unit_removed)
+            self._watching = True
+        self._selectors.extend(selectors)
+
+    def _matches_pattern(self, unit_name):
+        return any(s.matches(unit_name) for s in self._selectors)
+
+    def _unit_new(self, unit_name, unit_path):
+        if unit_name in self._units or not self._matches_pattern(unit_name):
+            return
+        unit = self._dbus_manager.unit_from_path(unit_name, unit_path, first_state_is_baseline = True)
+        self._units[unit_name] = unit
+        unit.register_listener(self._state_queue)
+        logging.info("Started monitoring %s"%(unit_name))
+
+    def _unit_removed(self, unit_name, unit_path):
+        if unit_name in self._exact_names:
+            return
+        unit = self._units.pop(unit_name, None)
+        if unit is None:
+            return
+        self._detach(unit)
+
+    def _unit_files_changed(self):
+        for unit in self._units.values():
+            unit.invalidate_properties(('UnitFileState',))
+
+    def _detach(self, unit):
+        if self._started:
+            unit.unregister_listener()
+            self._state_queue.put((unit, None))
+        logging.info("Stopped monitoring %s"%(unit.name))
+
+    def _process_inline(self, unit, state):
+        self._callback_managers[0].process(unit, state, self._change_callback, self._each_state_change_callback)
+        self._schedule_inline_timer()
+
+    def _schedule_inline_timer(self):
+        timeout = self._callback_managers[0].next_timeout()
+        if timeout is None:
+            return
+        deadline = time.time() + timeout
+        if self._timer_deadline is not None and self._timer_deadline <= deadline:
+            return
+        self._timer_deadline = deadline
+        self._dbus_manager.call_later(timeout, self._inline_timer_fired)
+
+    def _inline_timer_fired(self):
+        self._timer_deadline = None
+        self._process_inline(None, None)
+
     def _start_dbus_thread(self):
         return self._start_thread(target = lambda: self._dbus_manager.runner.run())
 
-    def _start_callback_thread(self):
-        return self._start_thread(target = lambda: self._callback_manager.start(self._change_callback, self._each_state_change_callback))
+    def _start_callback_thread(self, callback_manager):
+        return self._start_thread(target = lambda: callback_manager.start(self._change_callback, self._each_state_change_callback))
 
     def _start_thread(self, target):
         t = threading.Thread(target = target)
@@ -69,4 +262,13 @@ class Monitor(object):
         logging.debug("[%s] %s: %s %s"%(unit.name, unit.state_change.status_text,
                                         unit.state.active, unit.state.sub))
         logging.debug("[%s] \n%s"%(unit.name, str(unit.state_change)))
-        self._notification_center.notify(Notification(self._hostname, unit))
+        self._notification_center.notify(Notification(self._hostname, unit.snapshot()))
+
+def _unique(names):
+    seen   = set()
+    unique = []
+    for name in names:
+        if name not in seen:
+            seen.add(name)
+            unique.append(name)
+    return unique
@@ -1,19 +1,109 @@
+import collections
 import logging
 import threading
+import time
 
-def load_notifier(name):
-    import importlib
+import metrics
+
+from callback import UnitWithState
+from delivery import DeliveryPolicy
+from error import NotificationError
+from state import State
 
+def notifier_module(name):
     def camel_case(name):
         import re
         s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
         return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-    
-    module = importlib.import_module("systemd_notifier.notifiers.%s"%camel_case(name.capitalize()))
+
+    return "systemd_notifier.notifiers.%s"%camel_case(name.capitalize())
+
+def load_notifier(name):
+    import importlib
+
+    module = importlib.import_module(notifier_module(name))
     return getattr(module, name.capitalize())
 
+class LazyNotifier(object):
+
+    def __init__(self, name, options):
+        import pkgutil
+
+        if pkgutil.find_loader(notifier_module(name)) is None:
+            raise NotificationError("Unknown notifier '%s'"%(name))
+
+        self._notifier_name = name
+        self._options       = options
+        self._name          = "%sNotifier"%(name.capitalize())
+        self._notifier      = None
+        self._lock          = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def notifier(self):
+        with self._lock:
+            if self._notifier is None:
+                started        = time.time()
+                self._notifier = load_notifier(self._notifier_name)(self._options)
+                logging.debug("Loaded %s in %.3fs"%(self._name, time.time() - started))
+            return self._notifier
+
+    @property
+    def supports_batch(self):
+        return hasattr(self.notifier, 'notify_batch')
+
+    def load(self):
+        return self.notifier
+
+    def notify_start(self, hostname):
+        self.notifier.notify_start(hostname)
+
+    def notify_stop(self, hostname):
+        self.notifier.notify_stop(hostname)
+
+    def notify(self, notification):
+        self.notifier.notify(notification)
+
+    def notify_batch(self, notifications):
+        self.notifier.notify_batch(notifications)
+
+def supports_batch(notifier):
+    if isinstance(notifier, LazyNotifier):
+        return notifier.supports_batch
+    return hasattr(notifier, 'notify_batch')
+
+class RecordedUnit(object):
+
+    def __init__(self, name, maybe_service_type = None):
+        self._name               = name
+        self._maybe_service_type = maybe_service_type
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def maybe_service_type(self):
+        return self._maybe_service_type
+
+    def __str__(self):
+        if self.maybe_service_type:
+            return "%s (%s)"%(self.name, self.maybe_service_type)
+        return self.name
+
 class Notification(object):
 
+    @staticmethod
+    def from_record(record):
+        type = record.get('service_type')
+        unit = UnitWithState(RecordedUnit(record['unit'], type))
+        for values in record['states']:
+            unit.record_change(State(*(list(values) + [type])))
+        return Notification(record['hostname'], unit)
+
     def __init__(self, hostname, unit):
         self._hostname = hostname
         self._unit     = unit
@@ -33,27 +123,264 @@ class Notification(object):
     @property
     def type(self):
         if self.unit.state_change.is_ok:
-            if self.unit.state_change.states[0].is_failure:
+            if self.unit.state_change.original_state.is_failure:
                 return "ok"
             else:
                 return "info"
         else:
             return "alert"
 
+    def to_record(self):
+        state_change = self.unit.state_change
+        return {'hostname'     : self.hostname,
+                'unit'         : self.unit.name,
+                'service_type' : state_change.current_state.type,
+                'states'       : [[v.value for v in s.all_states] for s in state_change.states]}
+
+class NotifierDispatcher(object):
+
+    OVERFLOW_POLICIES = ('drop-oldest', 'coalesce', 'block')
+
+    def __init__(self, notifier, workers = 1, queue_size = 100, overflow = 'drop-oldest', delivery = None, outbox = None):
+        if overflow not in NotifierDispatcher.OVERFLOW_POLICIES:
+            raise NotificationError("Unknown overflow policy '%s'. Expected one of %s"%(
+                overflow, ", ".join(NotifierDispatcher.OVERFLOW_POLICIES)))
+
+        self._notifier   = notifier
+        self._queue_size = max(1, queue_size)
+        self._overflow   = overflow
+        self._pending    = collections.deque()
+        self._in_flight  = 0
+        self._closed     = False
+        self._condition  = threading.Condition()
+        self._sent       = 0
+        self._failed     = 0
+        self._dropped    = 0
+        self._coalesced  = 0
+        self._retried    = 0
+        self._delivery   = delivery or DeliveryPolicy()
+        self._rate_limit = self._delivery.rate_limiter()
+        self._outbox     = outbox
+        self._labels     = (notifier.name,)
+        self._latency    = metrics.histogram('systemd_notifier_notification_seconds', "Time spent sending each notification", ('notifier',))
+        self._failures   = metrics.counter('systemd_notifier_notification_failures_total', "Notifications that raised while sending", ('notifier',))
+        self._drops      = metrics.counter('systemd_notifier_notifications_dropped_total', "Notifications dropped because the queue was full", ('notifier',))
+        self._workers    = [self._start_worker() for _ in range(max(1, workers))]
+
+    @property
+    def notifier(self):
+        return self._notifier
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    @property
+    def stats(self):
+        with self._condition:
+            return {'queue_depth' : len(self._pending),
+                    'in_flight'   : self._in_flight,
+                    'sent'        : self._sent,
+                    'failed'      : self._failed,
+                    'dropped'     : self._dropped,
+                    'coalesced'   : self._coalesced,
+                    'retried'     : self._retried}
+
+    def submit(self, callable, key = None, record = None, outbox_id = None):
+        if self._outbox is not None and record is not None and outbox_id is None:
+            outbox_id = self._outbox.add(self._notifier.name, record)
+
+        with self._condition:
+            while len(self._pending) >= self._queue_size:
+                if self._overflow == 'coalesce' and key is not None and self._coalesce(key, callable, outbox_id):
+                    return
+                if self._overflow == 'block':
+                    self._condition.wait()
+                else:
+                    _, _, dropped_id = self._pending.popleft()
+                    self._discard(dropped_id)
+                    self._dropped += 1
+                    self._drops.inc(labels = self._labels)
+                    logging.warning("Dropped oldest pending notification for %s; queue is full.", self._notifier.name)
+            self._pending.append((key, callable, outbox_id))
+            self._condition.notify_all()
+
+    def join(self, timeout = None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _coalesce(self, key, callable, outbox_id):
+        for i, (pending_key, _, replaced_id) in enumerate(self._pending):
+            if pending_key == key:
+                self._discard(replaced_id)
+                self._pending[i] = (key, callable, outbox_id)
+                self._coalesced += 1
+                return True
+        return False
+
+    def _discard(self, outbox_id):
+        if self._outbox is not None and outbox_id is not None:
+            self._outbox.remove(outbox_id)
+
+    def _start_worker(self):
+        t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+        return t
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                _, callable, outbox_id = self._pending.popleft()
+                self._in_flight += 1
+                self._condition.notify_all()
+
+            succeeded = self._deliver(callable)
+            self._discard(outbox_id)
+
+            with self._condition:
+                self._in_flight -= 1
+                if succeeded:
+                    self._sent += 1
+                else:
+                    self._failed += 1
+                self._condition.notify_all()
+
+    def _deliver(self, callable):
+        attempt = 0
+        while True:
+            if self._rate_limit is not None:
+                self._rate_limit.acquire()
+
+            started = time.time()
+            try:
+                callable(self._notifier)
+                return True
+            except Exception as e:
+                attempt += 1
+                delay    = self._delivery.retry_delay(attempt, e)
+                if delay is None:
+                    logging.error("Failed to send notification via %s.", self._notifier.name, exc_info=True)
+                    self._failures.inc(labels = self._labels)
+                    return False
+                logging.warning("Failed to send notification via %s (attempt %d), retrying in %.1fs: %s",
+                                self._notifier.name, attempt, delay, e)
+                with self._condition:
+                    self._retried += 1
+            finally:
+                self._latency.observe(time.time() - started, labels = self._labels)
+            time.sleep(delay)
+
+class NotificationBatcher(object):
+
+    def __init__(self, window, max_size, flush):
+        self._window    = window
+        self._max_size  = max_size
+        self._flush     = flush
+        self._pending   = []
+        self._deadline  = None
+        self._condition = threading.Condition()
+
+        t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+
+    def add(self, notification):
+        with self._condition:
+            if not self._pending:
+                self._deadline = time.time() + self._window
+            self._pending.append(notification)
+            self._condition.notify_all()
+
+    def drain(self):
+        with self._condition:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._flush(batch)
+
+    def _is_due(self):
+        if self._max_size and len(self._pending) >= self._max_size:
+            return True
+        return time.time() >= self._deadline
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                while self._pending and not self._is_due():
+                    self._condition.wait(max(0, self._deadline - time.time()))
+                size = self._max_size or len(self._pending)
+                batch, self._pending = self._pending[:size], self._pending[size:]
+            if batch:
+                self._flush(batch)
+
 class NotificationCenter(object):
 
-    def __init__(self):
-        self._notifiers = []
+    def __init__(self, workers = 1, queue_size = 100, overflow = 'drop-oldest', batch_window = 0, batch_max = 0,
+                 delivery = None, outbox = None):
+        self._notifiers   = []
+        self._dispatchers = []
+        self._workers     = workers
+        self._queue_size  = queue_size
+        self._overflow    = overflow
+        self._delivery    = delivery
+        self._outbox      = outbox
+        self._batcher     = NotificationBatcher(batch_window, batch_max, self.notify_batch) if batch_window > 0 else None
+        metrics.gauge('systemd_notifier_notification_queue_depth', "Notifications waiting to be sent",
+                      lambda: dict(((d.notifier.name,), d.queue_depth) for d in self._dispatchers), ('notifier',))
 
-    def add_notifier(self, notifier):
-        self._notifiers.append(notifier)
+    def add_notifier(self, notifier, replay = True):
+        dispatcher = NotifierDispatcher(notifier, self._workers, self._queue_size, self._overflow,
+                                        self._delivery, self._outbox)
+        self._notifiers   = self._notifiers + [notifier]
+        self._dispatchers = self._dispatchers + [dispatcher]
+        if self._outbox is not None and replay:
+            self._replay_outbox(dispatcher)
+
+    def remove_notifier(self, notifier):
+        dispatchers       = [d for d in self._dispatchers if d.notifier is notifier]
+        self._notifiers   = [n for n in self._notifiers if n is not notifier]
+        self._dispatchers = [d for d in self._dispatchers if d.notifier is not notifier]
+        for dispatcher in dispatchers:
+            dispatcher.close()
+
+    @property
+    def stats(self):
+        return dict((d.notifier.name, d.stats) for d in self._dispatchers)
 
     def notify(self, notification):
-        def do_notify(notifier):
-            logging.debug("Notifying state change of %s via %s", notification.unit.name, notifier.name)
-            notifier.notify(notification)
-            
-        self._for_each_notifier(do_notify)
+        if self._batcher is not None:
+            self._batcher.add(notification)
+            return
+
+        record = self._record(notification)
+        for dispatcher in self._dispatchers:
+            self._submit_notification(dispatcher, notification, record)
+
+    def notify_batch(self, notifications):
+        records = [self._record(n) for n in notifications]
+        for dispatcher in self._dispatchers:
+            if len(notifications) > 1 and supports_batch(dispatcher.notifier):
+                self._submit_batch(dispatcher, notifications, records)
+            else:
+                for notification, record in zip(notifications, records):
+                    self._submit_notification(dispatcher, notification, record)
 
     def notify_start(self, hostname):
         logging.info("Systemd Notifier started.")
@@ -63,26 +390,63 @@ class NotificationCenter(object):
 
         self._for_each_notifier(do_notify_start)
 
-    def notify_stop(self, hostname):
+    def notify_stop(self, hostname, timeout = 10):
         logging.info("Systemd Notifier stopped.")
+        if self._batcher is not None:
+            self._batcher.drain()
+
         def do_notify_stop(notifier):
             logging.debug("Notifying systemd_notifier stop via %s"%(notifier.name))
             notifier.notify_stop(hostname)
 
         self._for_each_notifier(do_notify_stop)
-        
-    def _for_each_notifier(self, callable):
-        def callable_safe(notifier):
-            try:
-                callable(notifier)
-            except Exception as e:
-                logging.error("Failed to send notification via %s.", notifier.name, exc_info=True)
+        self.join(timeout)
+
+    def join(self, timeout = None):
+        deadline = None if timeout is None else time.time() + timeout
+        for dispatcher in self._dispatchers:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not dispatcher.join(remaining):
+                logging.warning("Timed out waiting for %d pending notifications via %s.",
+                                dispatcher.queue_depth, dispatcher.notifier.name)
+
+    def _record(self, notification):
+        if self._outbox is None:
+            return None
+        return notification.to_record()
 
-        threads = []
-        for notifier in self._notifiers:
-            t = threading.Thread(target=lambda: callable_safe(notifier))
-            threads.append(t)
-            t.start()
+    def _submit_notification(self, dispatcher, notification, record = None, outbox_id = None):
+        def do_notify(notifier):
+            logging.debug("Notifying state change of %s via %s", notification.unit.name, notifier.name)
+            notifier.notify(notification)
+
+        outbox_record = {'kind' : 'notify', 'notification' : record} if record is not None else None
+        dispatcher.submit(do_notify, key = notification.unit.name, record = outbox_record, outbox_id = outbox_id)
+
+    def _submit_batch(self, dispatcher, notifications, records = None, outbox_id = None):
+        def do_notify_batch(notifier):
+            logging.debug("Notifying state changes of %d units via %s", len(notifications), notifier.name)
+            notifier.notify_batch(notifications)
+
+        outbox_record = {'kind' : 'batch', 'notifications' : records} if records and records[0] is not None else None
+        dispatcher.submit(do_notify_batch, record = outbox_record, outbox_id = outbox_id)
+
+    def _replay_outbox(self, dispatcher):
+        pending = self._outbox.pending(dispatcher.notifier.name)
+        if pending:
+            logging.info("Resending %d notifications left in the outbox for %s", len(pending), dispatcher.notifier.name)
+        for outbox_id, record in pending:
+            try:
+                if record['kind'] == 'batch':
+                    notifications = [Notification.from_record(r) for r in record['notifications']]
+                    self._submit_batch(dispatcher, notifications, record['notifications'], outbox_id)
+                else:
+                    notification = Notification.from_record(record['notification'])
+                    self._submit_notification(dispatcher, notification, record['notification'], outbox_id)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error("Discarding unreadable outbox entry %d for %s", outbox_id, dispatcher.notifier.name, exc_info=True)
+                self._outbox.remove(outbox_id)
 
-        for t in threads:
-            t.join()
+    def _for_each_notifier(self, callable, key = None):
+        for dispatcher in self._dispatchers:
+            dispatcher.submit(callable, key)
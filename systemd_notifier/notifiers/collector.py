@@ -0,0 +1,87 @@
+import json
+import logging
+import socket
+import threading
+
+from systemd_notifier.error import NotifierError
+
+class Collector(object):
+
+    def __init__(self, options):
+        self._options = options
+        self._name    = "CollectorNotifier"
+
+        if not options['address'] and not options['socket']:
+            raise NotifierError("The collector notifier needs an 'address' (host:port) or a 'socket' path")
+
+        self._stream  = CollectorStream(address = options['address'] or None,
+                                        socket_path = options['socket'] or None,
+                                        timeout = float(options['timeout'] or 10),
+                                        token = options['token'] or None)
+
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def name(self):
+        return self._name
+
+    def notify_start(self, hostname):
+        self._stream.send([{'kind' : 'start', 'hostname' : hostname}])
+
+    def notify_stop(self, hostname):
+        self._stream.send([{'kind' : 'stop', 'hostname' : hostname}])
+
+    def notify(self, notification):
+        self._stream.send([{'kind' : 'notify', 'notification' : notification.to_record()}])
+
+    def notify_batch(self, notifications):
+        self._stream.send([{'kind' : 'notify', 'notification' : n.to_record()} for n in notifications])
+
+class CollectorStream(object):
+
+    def __init__(self, address = None, socket_path = None, timeout = 10, token = None):
+        self._address     = address
+        self._socket_path = socket_path
+        self._token       = token
+        self._timeout     = timeout
+        self._socket      = None
+        self._lock        = threading.Lock()
+
+    @property
+    def target(self):
+        return self._socket_path or self._address
+
+    def send(self, records):
+        data = "".join(json.dumps(r, separators = (',', ':')) + "\n" for r in records)
+        with self._lock:
+            for attempt in (1, 2):
+                reused = self._socket is not None
+                try:
+                    if self._socket is None:
+                        self._socket = self._connect()
+                    self._socket.sendall(data)
+                    return
+                except socket.error as e:
+                    self.close()
+                    if not reused or attempt == 2:
+                        raise NotifierError("Sending to collector %s failed"%(self.target), e)
+                    logging.debug("Connection to collector %s went stale; reconnecting", self.target)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _connect(self):
+        if self._socket_path:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(self._timeout)
+            s.connect(self._socket_path)
+        else:
+            host, _, port = self._address.rpartition(':')
+            s = socket.create_connection((host or '127.0.0.1', int(port)), self._timeout)
+        if self._token:
+            s.sendall(json.dumps({'kind' : 'auth', 'token' : self._token}, separators = (',', ':')) + "\n")
+        return s
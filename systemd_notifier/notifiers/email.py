@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+import logging
+import smtplib
+import socket
+import threading
+
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+from systemd_notifier.error import NotifierError, NotifierPermanentError
+
+class Email(object):
+
+    def __init__(self, options):
+        self._options = options
+        self._name    = "EmailNotifier"
+
+        recipients = options['to']
+        if isinstance(recipients, basestring):
+            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
+        if not options['from'] or not recipients:
+            raise NotifierError("The email notifier needs 'from' and 'to' addresses")
+
+        self._sender     = options['from']
+        self._recipients = recipients
+        self._session    = SMTPSession(host     = options['host'] or 'localhost',
+                                       port     = int(options['port'] or (465 if options['ssl'] else 25)),
+                                       ssl      = options['ssl'] is True,
+                                       starttls = options['starttls'] is True,
+                                       username = options['username'] or None,
+                                       password = options['password'] or None,
+                                       timeout  = float(options['timeout'] or 10))
+
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def name(self):
+        return self._name
+
+    def notify_start(self, hostname):
+        message = "SystemdNotifier is starting on %s"%(hostname)
+        self.send(message, message)
+
+    def notify_stop(self, hostname):
+        message = "SystemdNotifier is stopping on %s"%(hostname)
+        self.send(message, message)
+
+    def notify(self, notification):
+        self.send(self.subject(notification), self.body(notification))
+
+    def notify_batch(self, notifications):
+        types   = [n.type for n in notifications]
+        summary = ", ".join("%d %s"%(types.count(t), t) for t in ('alert', 'ok', 'info') if t in types)
+        hosts   = sorted(set(n.hostname for n in notifications))
+        subject = "%d systemd unit changes on %s (%s)"%(len(notifications), ", ".join(hosts), summary)
+
+        self.send(subject, "\n\n".join("%s\n%s"%(self.subject(n), self.body(n)) for n in notifications))
+
+    def send(self, subject, body):
+        message = MIMEText(body)
+        message['Subject'] = subject
+        message['From']    = self._sender
+        message['To']      = ", ".join(self._recipients)
+        message['Date']    = formatdate(localtime = True)
+
+        logging.debug("Sending email notification: %s"%(subject))
+        self._session.sendmail(self._sender, self._recipients, message.as_string())
+        logging.debug("Sent email notification")
+
+    @staticmethod
+    def subject(notification):
+        unit = notification.unit
+        return "%s: systemd unit %s on %s %s"%(notification.type,
+                                               unit.name,
+                                               notification.hostname,
+                                               unit.state_change.status_text)
+
+    @staticmethod
+    def body(notification):
+        unit  = notification.unit
+        lines = ["Hostname: %s"%(notification.hostname),
+                 "Unit: %s"%(unit.unit)]
+        return "\n".join(lines) + "\n" + str(unit.state_change)
+
+class SMTPSession(object):
+
+    def __init__(self, host, port = 25, ssl = False, starttls = False, username = None, password = None, timeout = 10):
+        self.host      = host
+        self.port      = port
+        self._ssl      = ssl
+        self._starttls = starttls
+        self._username = username
+        self._password = password
+        self._timeout  = timeout
+        self._smtp     = None
+        self._lock     = threading.Lock()
+
+    def sendmail(self, sender, recipients, message):
+        with self._lock:
+            for attempt in (1, 2):
+                reused = self._smtp is not None
+                try:
+                    if self._smtp is None:
+                        self._smtp = self._connect()
+                    self._smtp.sendmail(sender, recipients, message)
+                    return
+                except smtplib.SMTPRecipientsRefused as e:
+                    raise NotifierPermanentError("SMTP server %s refused all recipients"%(self.host), e)
+                except smtplib.SMTPResponseException as e:
+                    self.close()
+                    if e.smtp_code >= 500:
+                        raise NotifierPermanentError("SMTP server %s returned %d: %s"%(self.host, e.smtp_code, e.smtp_error))
+                    raise NotifierError("SMTP server %s returned %d: %s"%(self.host, e.smtp_code, e.smtp_error))
+                except (smtplib.SMTPException, socket.error) as e:
+                    self.close()
+                    if not reused or attempt == 2:
+                        raise NotifierError("Sending mail via %s failed"%(self.host), e)
+                    logging.debug("SMTP session with %s went stale; reconnecting", self.host)
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, socket.error) as e:
+            self._smtp.close()
+        self._smtp = None
+
+    def _connect(self):
+        if self._ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout = self._timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout = self._timeout)
+        if self._starttls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self._username:
+            smtp.login(self._username, self._password)
+        return smtp
@@ -1,9 +1,13 @@
 import logging
 import json
-import urllib2
+
+from systemd_notifier import profiling
+from systemd_notifier.connection import HTTPConnectionPool, check_response
 
 class Slack(object):
 
+    MAX_ATTACHMENTS = 100
+
     def __init__(self, options):
         self._options = options
         self._name    = "SlackNotifier"
@@ -12,7 +16,9 @@ class Slack(object):
                                      channel    = options['channel'],
                                      username   = options['username'],
                                      icon_emoji = options['icon_emoji'],
-                                     icon_url   = options['icon_url'])
+                                     icon_url   = options['icon_url'],
+                                     timeout    = float(options['timeout'] or 10),
+                                     keep_alive = options['keep_alive'] is not False)
 
     @property
     def options(self):
@@ -45,21 +51,50 @@ class Slack(object):
         self._webhook.ping("", attachments = [attach])
 
     def notify(self, notification):
-        unit    = notification.unit
-        message = "%s: systemd unit %s on %s %s"%(notification.type,
-                                                  unit.name,
-                                                  notification.hostname,
-                                                  unit.state_change.status_text)
-
-        attach  = {
-            'fallback' : "%s: %s (%s)"%(message, unit.state.active, unit.state.sub),
-            'color'    : self.color(notification.type),
-            'fields'   : self.fields(notification)}
+        started = profiling.now()
+        message = self.message(notification)
+        attach  = self.attachment(notification, message)
+        profiling.record('render', started, notification.unit.name)
 
         logging.debug("Sending slack notification with attachment: %s"%(attach))
         self._webhook.ping(message, attachments = [attach])
         logging.debug("Sent slack notification")
 
+    def notify_batch(self, notifications):
+        started = profiling.now()
+        types   = [n.type for n in notifications]
+        summary = ", ".join("%d %s"%(types.count(t), t) for t in ('alert', 'ok', 'info') if t in types)
+        hosts   = sorted(set(n.hostname for n in notifications))
+        message = "%d systemd unit changes on %s (%s)"%(len(notifications), ", ".join(hosts), summary)
+
+        for i in range(0, len(notifications), Slack.MAX_ATTACHMENTS):
+            attachments = []
+            for notification in notifications[i:i + Slack.MAX_ATTACHMENTS]:
+                attach = self.attachment(notification, self.message(notification))
+                attach['title'] = "%s %s"%(notification.unit.name, notification.unit.state_change.status_text)
+                attachments.append(attach)
+            profiling.record('render', started, "batch of %d"%(len(notifications)))
+
+            logging.debug("Sending slack batch notification with %d attachments"%(len(attachments)))
+            self._webhook.ping(message, attachments = attachments)
+        logging.debug("Sent slack batch notification")
+
+    @staticmethod
+    def message(notification):
+        unit = notification.unit
+        return "%s: systemd unit %s on %s %s"%(notification.type,
+                                               unit.name,
+                                               notification.hostname,
+                                               unit.state_change.status_text)
+
+    @staticmethod
+    def attachment(notification, message):
+        unit = notification.unit
+        return {
+            'fallback' : "%s: %s (%s)"%(message, unit.state.active, unit.state.sub),
+            'color'    : Slack.color(notification.type),
+            'fields'   : Slack.fields(notification)}
+
     @staticmethod
     def color(type):
         if type == 'alert':
@@ -87,12 +122,13 @@ class Slack(object):
 
 class SlackWebHook(object):
             
-    def __init__(self, url, channel, username, icon_emoji, icon_url):
+    def __init__(self, url, channel, username, icon_emoji, icon_url, timeout = 10, keep_alive = True):
         self.url = url
         self.channel = channel
         self.username = username
         self.icon_emoji = icon_emoji
         self.icon_url = icon_url
+        self.pool = HTTPConnectionPool.for_url(url, timeout, keep_alive)
 
     def ping(self, text, attachments=None):
         message = {
@@ -104,5 +140,8 @@ class SlackWebHook(object):
             'icon_url'    : self.icon_url
         }
 
-        request = urllib2.Request(self.url, json.dumps(message), {'Content-Type': 'application/json', 'Content-Length': len(json.dumps(message))})
-        response = urllib2.urlopen(request)
+        body    = json.dumps(message)
+        started = profiling.now()
+        status, response, headers = self.pool.post(self.url, body, {'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+        profiling.record('send', started, self.pool.netloc)
+        check_response("Slack webhook", status, response, headers)
@@ -0,0 +1,73 @@
+import logging
+import json
+
+from systemd_notifier.connection import HTTPConnectionPool, check_response
+
+class Webhook(object):
+
+    def __init__(self, options):
+        self._options = options
+        self._name    = "WebhookNotifier"
+
+        self._endpoint = WebhookEndpoint(url        = options['url'],
+                                         headers    = options['headers'] or {},
+                                         timeout    = float(options['timeout'] or 10),
+                                         keep_alive = options['keep_alive'] is not False)
+
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def name(self):
+        return self._name
+
+    def notify_start(self, hostname):
+        self._endpoint.post({'event' : 'start', 'hostname' : hostname})
+
+    def notify_stop(self, hostname):
+        self._endpoint.post({'event' : 'stop', 'hostname' : hostname})
+
+    def notify(self, notification):
+        payload = self.payload(notification)
+        payload['event'] = 'change'
+
+        logging.debug("Sending webhook notification: %s"%(payload))
+        self._endpoint.post(payload)
+
+    def notify_batch(self, notifications):
+        logging.debug("Sending webhook batch notification with %d changes"%(len(notifications)))
+        self._endpoint.post({'event'   : 'changes',
+                             'changes' : [self.payload(n) for n in notifications]})
+
+    @staticmethod
+    def payload(notification):
+        unit  = notification.unit
+        state = unit.state
+        return {
+            'hostname'     : notification.hostname,
+            'unit'         : unit.name,
+            'service_type' : state.type,
+            'type'         : notification.type,
+            'status'       : unit.state_change.status_text,
+            'state'        : dict((v.name, v.value) for v in state.all_states),
+            'changes'      : [{'name'   : values[0].name,
+                               'values' : [v.value for v in values]}
+                              for values in unit.state_change.diff()]}
+
+class WebhookEndpoint(object):
+
+    def __init__(self, url, headers = None, timeout = 10, keep_alive = True):
+        self.url     = url
+        self.headers = dict(headers or {})
+        self.pool    = HTTPConnectionPool.for_url(url, timeout, keep_alive)
+
+        self.headers['Content-Type'] = 'application/json'
+
+    def post(self, payload):
+        body    = json.dumps(payload, separators = (',', ':'))
+        headers = dict(self.headers)
+        headers['Content-Length'] = str(len(body))
+
+        status, response, headers = self.pool.post(self.url, body, headers)
+        check_response("Webhook %s"%(self.url), status, response, headers)
@@ -0,0 +1,110 @@
+import collections
+import heapq
+import logging
+import threading
+import time
+
+STAGES = ('signal', 'build_state', 'queue_wait', 'classify', 'render', 'send')
+
+class Profiler(object):
+
+    def __init__(self, samples = 10000, slowest = 10):
+        self.enabled   = False
+        self._samples  = samples
+        self._slowest  = slowest
+        self._lock     = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+        logging.info("Stage profiling enabled")
+
+    def disable(self):
+        self.enabled = False
+        logging.info("Stage profiling disabled")
+
+    def toggle(self):
+        if self.enabled:
+            self.dump()
+            self.disable()
+        else:
+            self.enable()
+
+    def reset(self):
+        with self._lock:
+            self._started   = time.time()
+            self._durations = dict((s, collections.deque(maxlen = self._samples)) for s in STAGES)
+            self._counts    = dict((s, 0) for s in STAGES)
+            self._worst     = []
+
+    def observe(self, stage, seconds, detail = None):
+        with self._lock:
+            self._durations[stage].append(seconds)
+            self._counts[stage] += 1
+            if len(self._worst) < self._slowest:
+                heapq.heappush(self._worst, (seconds, stage, detail))
+            elif seconds > self._worst[0][0]:
+                heapq.heapreplace(self._worst, (seconds, stage, detail))
+
+    def summary(self):
+        with self._lock:
+            elapsed   = time.time() - self._started
+            durations = dict((s, sorted(d)) for s, d in self._durations.items())
+            counts    = dict(self._counts)
+            worst     = sorted(self._worst, reverse = True)
+
+        lines = ["Stage profile over %.1fs:"%(elapsed),
+                 "  %-12s %10s %10s %10s %10s"%("stage", "count", "p50 ms", "p99 ms", "max ms")]
+        for stage in STAGES:
+            values = durations[stage]
+            if not values:
+                continue
+            lines.append("  %-12s %10d %10.3f %10.3f %10.3f"%(stage, counts[stage],
+                                                              _percentile(values, 50) * 1000,
+                                                              _percentile(values, 99) * 1000,
+                                                              values[-1] * 1000))
+        if worst:
+            lines.append("Slowest events:")
+            for seconds, stage, detail in worst:
+                lines.append("  %10.3f ms %-12s %s"%(seconds * 1000, stage, detail or ""))
+        return "\n".join(lines)
+
+    def dump(self):
+        logging.info(self.summary())
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+PROFILER = Profiler()
+
+def configure(samples = 10000, slowest = 10):
+    global PROFILER
+    PROFILER = Profiler(samples, slowest)
+    return PROFILER
+
+def is_enabled():
+    return PROFILER.enabled
+
+def now():
+    if PROFILER.enabled:
+        return time.time()
+    return None
+
+def record(stage, started, detail = None):
+    if started is None or not PROFILER.enabled:
+        return
+    PROFILER.observe(stage, time.time() - started, detail)
+
+def start_reporter(interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            if PROFILER.enabled:
+                PROFILER.dump()
+                PROFILER.reset()
+
+    t = threading.Thread(target = run)
+    t.daemon = True
+    t.start()
+    return t
@@ -0,0 +1,127 @@
+import json
+import logging
+import threading
+import time
+
+from state import State
+
+TRACE_VERSION = 1
+
+def _monotonic_clock():
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno = True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            t = timespec()
+            clock_gettime(1, ctypes.byref(t))
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        monotonic()
+        return monotonic
+    except (OSError, AttributeError) as e:
+        logging.warning("No monotonic clock available; trace timestamps use the wall clock")
+        return time.time
+
+monotonic = _monotonic_clock()
+
+class TraceWriter(object):
+
+    def __init__(self, path, flush_interval = 1.0):
+        self._path           = path
+        self._file           = open(path, 'w')
+        self._flush_interval = flush_interval
+        self._started        = monotonic()
+        self._lock           = threading.Lock()
+        self._count          = 0
+        self._write({'version' : TRACE_VERSION, 'started' : time.time()})
+        logging.info("Recording unit states to %s"%(path))
+
+        t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def count(self):
+        return self._count
+
+    def record(self, unit_name, state):
+        offset = round(monotonic() - self._started, 6)
+        if state is None:
+            entry = [offset, unit_name]
+        else:
+            entry = [offset, unit_name] + [v.value for v in state.all_states] + [state.type]
+        with self._lock:
+            self._write(entry)
+            self._count += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators = (',', ':')) + "\n")
+
+    def _run(self):
+        while not self._file.closed:
+            time.sleep(self._flush_interval)
+            self.flush()
+
+class RecordingStateQueue(object):
+
+    def __init__(self, queue, writer):
+        self._queue  = queue
+        self._writer = writer
+
+    def put(self, item):
+        unit, state = item
+        self._writer.record(unit.name, state)
+        self._queue.put(item)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+class TraceReader(object):
+
+    def __init__(self, path):
+        self._path = path
+        with open(path) as f:
+            header = json.loads(f.readline())
+        if header.get('version') != TRACE_VERSION:
+            raise ValueError("Unsupported trace version %s in %s"%(header.get('version'), path))
+        self._started = header.get('started')
+
+    @property
+    def started(self):
+        return self._started
+
+    def __iter__(self):
+        with open(self._path) as f:
+            f.readline()
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    if line.endswith("\n"):
+                        raise
+                    logging.warning("Ignoring truncated last record in %s", self._path)
+                    return
+                if len(entry) == 2:
+                    yield entry[0], entry[1], None
+                else:
+                    yield entry[0], entry[1], State(*entry[2:])
@@ -0,0 +1,146 @@
+import argparse
+import cProfile
+import logging
+import pstats
+import sys
+import time
+
+from callback import CallbackManager
+from notification import Notification, NotificationCenter
+from recording import TraceReader
+
+class ReplayUnit(object):
+
+    def __init__(self, name):
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def __str__(self):
+        return self._name
+
+class StubNotifier(object):
+
+    def __init__(self):
+        self.name          = "StubNotifier"
+        self.notifications = 0
+        self.types         = {}
+
+    def notify_start(self, hostname):
+        pass
+
+    def notify_stop(self, hostname):
+        pass
+
+    def notify(self, notification):
+        self.notifications += 1
+        self.types[notification.type] = self.types.get(notification.type, 0) + 1
+
+    def notify_batch(self, notifications):
+        for notification in notifications:
+            self.notify(notification)
+
+class Replayer(object):
+
+    def __init__(self, trace, notification_center, hostname = 'replay', debounce = 0, debounce_max = None, realtime = False):
+        self._trace               = trace
+        self._notification_center = notification_center
+        self._hostname            = hostname
+        self._realtime            = realtime
+        self._callback_manager    = CallbackManager(None, debounce, debounce_max)
+        self._units               = {}
+        self._change_callback     = lambda unit: self._notification_center.notify(Notification(self._hostname, unit.snapshot()))
+        self._events              = 0
+        self._waited              = 0
+
+    @property
+    def events(self):
+        return self._events
+
+    @property
+    def waited(self):
+        return self._waited
+
+    @property
+    def units(self):
+        return len(self._units)
+
+    def run(self):
+        started = time.time()
+        for offset, unit_name, state in self._trace:
+            if self._realtime:
+                self._wait_until(started + offset)
+            unit = self._units.get(unit_name)
+            if unit is None:
+                unit = self._units[unit_name] = ReplayUnit(unit_name)
+            self._callback_manager.process(unit, state, self._change_callback, None)
+            self._events += 1
+        self._settle()
+        return time.time() - started
+
+    def _wait_until(self, deadline):
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            timeout = self._callback_manager.next_timeout()
+            if timeout is not None and timeout < remaining:
+                self._sleep(timeout)
+                self._callback_manager.process(None, None, self._change_callback, None)
+            else:
+                self._sleep(remaining)
+
+    def _settle(self):
+        timeout = self._callback_manager.next_timeout()
+        while timeout is not None:
+            self._sleep(timeout)
+            self._callback_manager.process(None, None, self._change_callback, None)
+            timeout = self._callback_manager.next_timeout()
+
+    def _sleep(self, seconds):
+        started = time.time()
+        time.sleep(seconds)
+        self._waited += time.time() - started
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="systemd-notifier replay",
+                                     description="Replay a recorded unit state trace through the state machine with stubbed notifiers")
+    parser.add_argument("trace", help="trace file written with --record")
+    parser.add_argument("--realtime", action="store_true", help="replay at the original speed instead of as fast as possible")
+    parser.add_argument("--debounce", type=float, default=0, help="debounce window in seconds")
+    parser.add_argument("--debounce-max", type=float, help="maximum debounce delay in seconds")
+    parser.add_argument("--profile", action="store_true", help="print a cProfile breakdown of the replay")
+    parser.add_argument("--top", type=int, default=25, help="number of functions in the profile (default 25)")
+    parser.add_argument("--sort", default="cumulative", help="profile sort key (default cumulative)")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+
+    notifier            = StubNotifier()
+    notification_center = NotificationCenter(queue_size = 1000000, overflow = 'block')
+    notification_center.add_notifier(notifier)
+    replayer            = Replayer(TraceReader(args.trace), notification_center,
+                                   debounce     = args.debounce,
+                                   debounce_max = args.debounce_max,
+                                   realtime     = args.realtime)
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+    elapsed = replayer.run()
+    if profile is not None:
+        profile.disable()
+    notification_center.join()
+
+    busy = max(elapsed - replayer.waited, 1e-9)
+    print "events          %d"%(replayer.events)
+    print "units           %d"%(replayer.units)
+    print "notifications   %d (%s)"%(notifier.notifications, ", ".join("%d %s"%(n, t) for t, n in sorted(notifier.types.items())))
+    print "elapsed         %.3fs (%.3fs waiting)"%(elapsed, replayer.waited)
+    print "throughput      %.0f events/sec"%(replayer.events / busy)
+
+    if profile is not None:
+        print
+        pstats.Stats(profile, stream = sys.stdout).sort_stats(args.sort).print_stats(args.top)
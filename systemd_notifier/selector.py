@@ -0,0 +1,32 @@
+import fnmatch
+import re
+
+class UnitSelector(object):
+
+    REGEX_PREFIX    = 're:'
+    GLOB_CHARACTERS = '*?['
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+        if pattern.startswith(UnitSelector.REGEX_PREFIX):
+            self._regex = re.compile(pattern[len(UnitSelector.REGEX_PREFIX):])
+        elif any(c in pattern for c in UnitSelector.GLOB_CHARACTERS):
+            self._regex = re.compile(fnmatch.translate(pattern))
+        else:
+            self._regex = None
+
+    @property
+    def pattern(self):
+        return self._pattern
+
+    @property
+    def is_exact(self):
+        return self._regex is None
+
+    def matches(self, unit_name):
+        if self._regex is None:
+            return unit_name == self._pattern
+        return self._regex.match(unit_name) is not None
+
+    def __str__(self):
+        return self._pattern
@@ -1,10 +1,22 @@
+import collections
 import datetime
+import time
+
+def intern_value(value):
+    if value is None:
+        return None
+    try:
+        return intern(str(value))
+    except UnicodeError:
+        return value
 
 class StateValue(object):
 
-    def __init__(self, name, value, timestamp, ok_states = [], failure_states = []):
+    __slots__ = ('_name', '_value', '_timestamp', '_ok_states', '_failure_states')
+
+    def __init__(self, name, value, timestamp, ok_states = (), failure_states = ()):
         self._name = name
-        self._value = value
+        self._value = intern_value(value)
         self._timestamp = timestamp
         self._ok_states = ok_states
         self._failure_states = failure_states
@@ -19,6 +31,8 @@ class StateValue(object):
 
     @property
     def timestamp(self):
+        if isinstance(self._timestamp, float):
+            return datetime.datetime.fromtimestamp(self._timestamp)
         return self._timestamp
 
     @property
@@ -29,6 +43,12 @@ class StateValue(object):
     def failure_states(self):
         return self._failure_states
 
+    @property
+    def created(self):
+        if isinstance(self._timestamp, float):
+            return self._timestamp
+        return time.mktime(self._timestamp.timetuple()) + self._timestamp.microsecond / 1e6
+
     @property
     def display_name(self):
         return self.name.capitalize()
@@ -39,15 +59,15 @@ class StateValue(object):
 
     @property
     def is_ok(self):
-        if any(s for s in self.ok_states):
-            return self.value in self.ok_states
+        if self._ok_states:
+            return self._value in self._ok_states
         else:
             return True
 
     @property
     def is_failure(self):
-        if any(s for s in self.failure_states):
-            return self.value in self.failure_states
+        if self._failure_states:
+            return self._value in self._failure_states
         else:
             return False
 
@@ -66,33 +86,45 @@ class StateValue(object):
 
 class State(object):
 
+    __slots__ = ('_type', '_active', '_sub', '_loaded', '_unit_file', '_all_states')
+
+    ONESHOT_ACTIVE_STATES = (('inactive',), ('failed',))
+    ACTIVE_STATES         = (('active',), ('inactive', 'failed'))
+    ONESHOT_FILE_STATES   = ((), ())
+    FILE_STATES           = (('enabled', 'linked-runtime', 'static'), ('disabled',))
+    LOADED_STATES         = (('loaded',), ())
+
     @staticmethod
     def active_states(type):
         if type == 'oneshot':
-            return [['inactive'], ['failed']]
+            return State.ONESHOT_ACTIVE_STATES
         else:
-            return [['active'], ['inactive', 'failed']]
+            return State.ACTIVE_STATES
 
     @staticmethod
     def file_states(type):
         if type == 'oneshot':
-            return [[], []]
+            return State.ONESHOT_FILE_STATES
         else:
-            return [['enabled', 'linked-runtime', 'static'], ['disabled']]
+            return State.FILE_STATES
 
     def __init__(self, active, sub, loaded, unit_file, type=None):
-        timestamp = datetime.datetime.now()
-        self._type   = type
+        timestamp = time.time()
+        self._type   = intern_value(type)
         self._active = StateValue("active", active, timestamp, *State.active_states(type))
         self._sub    = StateValue("status", sub, timestamp)
-        self._loaded = StateValue("loaded", loaded, timestamp, ['loaded'])
+        self._loaded = StateValue("loaded", loaded, timestamp, *State.LOADED_STATES)
         self._unit_file = StateValue("file", unit_file, timestamp, *State.file_states(type))
-        self._all_states = [self._active, self._sub, self._loaded, self.unit_file]
+        self._all_states = (self._active, self._sub, self._loaded, self._unit_file)
 
     @property
     def active(self):
         return self._active
 
+    @property
+    def created(self):
+        return self._active.created
+
     @property
     def sub(self):
         return self._sub
@@ -139,60 +171,95 @@ class State(object):
 
 class StateChange(object):
 
+    HISTORY_SIZE = 32
+
     def __init__(self, original_state = None):
-        self._states = []
+        self._original         = None
+        self._recent           = collections.deque(maxlen = StateChange.HISTORY_SIZE)
+        self._count            = 0
+        self._saw_deactivating = False
+        self._saw_auto_restart = False
+        self._saw_reloading    = False
+        self._changed          = []
+        self._diff             = None
         if original_state:
-            self._states.append(original_state)
+            self.record_change(original_state)
 
     @property
     def states(self):
-        return self._states
+        if self._original is None:
+            return []
+        return [self._original] + list(self._recent)
+
+    @property
+    def original_state(self):
+        return self._original
 
     @property
     def current_state(self):
-        return self._states[-1]
+        if self._recent:
+            return self._recent[-1]
+        elif self._original is not None:
+            return self._original
+        raise IndexError("no states recorded")
 
     @property
     def changes(self):
-        return self._states[1:]
+        return list(self._recent)
+
+    @property
+    def count(self):
+        return self._count
 
     def record_change(self, state):
-        self._states.append(state)
+        if self._original is None:
+            self._original = state
+        else:
+            self._recent.append(state)
+            for i, (original, value) in enumerate(zip(self._original.all_states, state.all_states)):
+                if i not in self._changed and value.value != original.value:
+                    self._changed.append(i)
+            self._saw_deactivating = self._saw_deactivating or state.active.value == 'deactivating'
+            self._saw_auto_restart = self._saw_auto_restart or state.sub.value == 'auto-restart'
+            self._saw_reloading    = self._saw_reloading or state.active.value == 'reloading'
+        self._count += 1
+        self._diff   = None
     
     @property
     def is_ok(self):
-        return self.states[-1].is_ok
+        return self.current_state.is_ok
 
     @property
     def is_failure(self):
-        return self.states[-1].is_failure
+        return self.current_state.is_failure
     
     @property
     def is_recovery(self):
-        return self.states[0].is_failure and self.states[-1].is_ok
+        return self._original.is_failure and self.current_state.is_ok
 
     @property
     def is_restart(self):
-        return self.states[0].is_ok and self.states[-1].is_ok and any(s.active.value == 'deactivating' for s in self.changes)
+        return self._saw_deactivating and self._original.is_ok and self.current_state.is_ok
 
     @property
     def is_auto_restart(self):
-        return self.states[0].is_ok and self.states[-1].is_ok and any(s.sub.value == 'auto-restart' for s in self.changes)
+        return self._saw_auto_restart and self._original.is_ok and self.current_state.is_ok
 
     @property
     def is_reload(self):
-        return self.states[0].is_ok and self.states[-1].is_ok and any(s.active.value == 'reloading' for s in self.changes)
+        return self._saw_reloading and self._original.is_ok and self.current_state.is_ok
 
     @property
     def is_still_failure(self):
-        return len(self.states) > 1 and self.states[0].is_failure and self.states[-1].is_failure
+        return self._count > 1 and self._original.is_failure and self.current_state.is_failure
 
     @property
     def is_important(self):
-        if len(self.states) == 1:
-            return self.states[0].is_failure
+        if self._count == 1:
+            return self._original.is_failure
         else:
-            return any(s[-1].is_important for s in self.diff())
+            current = self.current_state.all_states
+            return any(current[i].is_important for i in self._changed)
 
     @property
     def status_text(self):
@@ -212,10 +279,13 @@ class StateChange(object):
             return "started"
     
     def zipped(self):
-        return zip(*(s.all_states for s in self._states))
+        return zip(*(s.all_states for s in self.states))
 
     def diff(self):
-        return [states for states in self.zipped() if not all(s.value == states[0].value for s in states)]
+        if self._diff is None:
+            states     = self.states
+            self._diff = [tuple(s.all_states[i] for s in states) for i in sorted(self._changed)]
+        return self._diff
 
     def __str__(self):
         return reduce(lambda s, states: s +
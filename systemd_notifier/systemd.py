@@ -1,17 +1,23 @@
 import dbus
 import dbus.mainloop.glib
 import gobject
+import logging
+import os
 
 dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 gobject.threads_init()
 
+import metrics
+import profiling
+
 from state import State
 from error import SystemdError, UnknownUnitError
 
 class DBusManager(object):
 
-    def __init__(self):
-        self.system_bus     = dbus.SystemBus()
+    def __init__(self, cache_properties = False, shared_signals = False, bus = None):
+        self.cache_properties = cache_properties
+        self.system_bus     = bus if bus is not None else dbus.SystemBus()
         self.systemd_object = self.system_bus.get_object('org.freedesktop.systemd1',
                                                          '/org/freedesktop/systemd1')
         self.systemd_manager = dbus.Interface(self.systemd_object, dbus_interface='org.freedesktop.systemd1.Manager')
@@ -19,30 +25,148 @@ class DBusManager(object):
             self.systemd_manager.Subscribe()
         except dbus.DBusException as e:
             raise SystemdError("Systemd is not installed, or is an incompatable version. It must provide the Subscribe dbus method: version 204 is the minimum recommended version.", e)
+        self.signal_router = PropertiesChangedRouter(self.system_bus) if shared_signals else None
       
     def fetch_unit(self, unit_name):
         try:
             unit_path   = self.systemd_manager.LoadUnit(unit_name)
-            unit_object = self.system_bus.get_object('org.freedesktop.systemd1', str(unit_path))
-            return DBusUnit(unit_name, unit_path, unit_object)
+            unit_object = self._unit_object(unit_path)
+            return DBusUnit(unit_name, unit_path, unit_object, self.cache_properties, signal_router = self.signal_router)
         except dbus.DBusException as e:
             raise UnknownUnitError("Unknown or unloaded systemd unit '%s'"%(unit_name), e)
 
+    def fetch_units(self, unit_names):
+        unit_names  = list(unit_names)
+        listed      = self._list_units(unit_names)
+        file_states = self._unit_file_states() if listed else {}
+
+        units = []
+        for unit_name in unit_names:
+            if unit_name not in listed:
+                units.append(self.fetch_unit(unit_name))
+                continue
+
+            _, _, load_state, active_state, sub_state, _, unit_path = listed[unit_name][:7]
+            unit = self.unit_from_path(unit_name, unit_path)
+            unit.seed_properties({'LoadState'   : load_state,
+                                  'ActiveState' : active_state,
+                                  'SubState'    : sub_state})
+            file_state = file_states.get(unit_name)
+            if file_state is not None:
+                unit.seed_properties({'UnitFileState' : file_state})
+            units.append(unit)
+        return units
+
+    def unit_from_path(self, unit_name, unit_path, first_state_is_baseline = False):
+        return DBusUnit(unit_name, unit_path, self._unit_object(unit_path), self.cache_properties,
+                        lazy_type = True, signal_router = self.signal_router,
+                        first_state_is_baseline = first_state_is_baseline)
+
+    def load_service_types(self, units):
+        pending = [0]
+        def done():
+            pending[0] -= 1
+
+        for unit in units:
+            pending[0] += 1
+            unit.request_service_type(done)
+        while pending[0] > 0:
+            gobject.main_context_default().iteration(True)
+
+    def list_unit_names(self):
+        return [str(u[0]) for u in self.systemd_manager.ListUnits()]
+
+    def on_unit_new(self, callback):
+        self.systemd_manager.connect_to_signal("UnitNew", lambda name, path: callback(str(name), path))
+
+    def on_unit_removed(self, callback):
+        self.systemd_manager.connect_to_signal("UnitRemoved", lambda name, path: callback(str(name), path))
+
+    def on_unit_files_changed(self, callback):
+        self.systemd_manager.connect_to_signal("UnitFilesChanged", lambda: callback())
+
+    def _unit_object(self, unit_path):
+        return self.system_bus.get_object('org.freedesktop.systemd1', str(unit_path), introspect = False)
+
+    def _list_units(self, unit_names):
+        try:
+            listing = self.systemd_manager.ListUnitsByNames(unit_names)
+        except dbus.DBusException:
+            try:
+                listing = self.systemd_manager.ListUnits()
+            except dbus.DBusException:
+                return {}
+        wanted = set(unit_names)
+        return dict((str(u[0]), u) for u in listing if str(u[0]) in wanted and str(u[2]) != 'not-found')
+
+    def _unit_file_states(self):
+        try:
+            return dict((os.path.basename(str(path)), state) for path, state in self.systemd_manager.ListUnitFiles())
+        except dbus.DBusException:
+            return {}
+
+    def call_later(self, seconds, callback):
+        def once():
+            callback()
+            return False
+        gobject.timeout_add(int(seconds * 1000), once)
+
     @property
     def runner(self):
         gobject.MainLoop().run()
 
+class PropertiesChangedRouter(object):
+
+    def __init__(self, bus):
+        self._listeners = {}
+        self._match     = bus.add_signal_receiver(self._dispatch,
+                                                  signal_name    = "PropertiesChanged",
+                                                  dbus_interface = DBusUnit.IFACE_PROPS,
+                                                  bus_name       = 'org.freedesktop.systemd1',
+                                                  path_keyword   = 'path',
+                                                  arg0           = DBusUnit.IFACE_UNIT)
+
+    def __len__(self):
+        return len(self._listeners)
+
+    def add(self, path, unit, queue):
+        self._listeners[str(path)] = (unit, queue)
+
+    def remove(self, path):
+        self._listeners.pop(str(path), None)
+
+    def _dispatch(self, iface, changed = None, invalidated = (), path = None):
+        listener = self._listeners.get(path)
+        if listener is not None:
+            unit, queue = listener
+            unit._on_properties_changed(queue, changed, invalidated)
+
 class DBusUnit(object):
 
     IFACE_UNIT    = "org.freedesktop.systemd1.Unit"
     IFACE_SERVICE = "org.freedesktop.systemd1.Service"
     IFACE_PROPS   = "org.freedesktop.DBus.Properties"
 
-    def __init__(self, name, path, dbus_object):
+    STATE_PROPERTIES = ('ActiveState', 'SubState', 'LoadState', 'UnitFileState')
+
+    def __init__(self, name, path, dbus_object, cache_properties = False, lazy_type = False, signal_router = None,
+                 first_state_is_baseline = False):
         self._name               = name
         self._path               = path
         self._dbus_object        = dbus_object
-        self._maybe_service_type = self._service_type()
+        self._cache_properties   = cache_properties
+        self._properties         = {}
+        self._signal_router      = signal_router
+        self._signal_match       = None
+        self._last_values        = None
+        self._states_enqueued    = 0
+        self._states_suppressed  = 0
+        self._signals_metric     = metrics.counter('systemd_notifier_dbus_signals_total', "PropertiesChanged signals received for monitored units")
+        self._enqueued_metric    = metrics.counter('systemd_notifier_states_enqueued_total', "Unit states put on the state queue")
+        self._suppressed_metric  = metrics.counter('systemd_notifier_states_suppressed_total', "Unit states dropped as duplicates of the previous state")
+        self._maybe_service_type = None if lazy_type else self._service_type()
+        self._has_service_type   = not lazy_type
+        self._baseline_first     = first_state_is_baseline
 
     @property
     def name(self):
@@ -58,13 +182,48 @@ class DBusUnit(object):
 
     @property
     def maybe_service_type(self):
+        if not self._has_service_type:
+            self._maybe_service_type = self._service_type()
+            self._has_service_type   = True
         return self._maybe_service_type
 
+    @property
+    def cache_properties(self):
+        return self._cache_properties
+
+    @property
+    def first_state_is_baseline(self):
+        return self._baseline_first
+
+    @property
+    def states_enqueued(self):
+        return self._states_enqueued
+
+    @property
+    def states_suppressed(self):
+        return self._states_suppressed
+
+    def seed_properties(self, properties):
+        self._properties.update(properties)
+
+    def invalidate_properties(self, properties):
+        self._merge_properties(None, properties)
+
     def register_listener(self, queue):
-        self._enqueue_state(queue)
-        self.dbus_object.connect_to_signal("PropertiesChanged",
-                                           lambda iface, *args: self._enqueue_state(queue) if iface == DBusUnit.IFACE_UNIT else None,
-                                           dbus_interface = DBusUnit.IFACE_PROPS)
+        self._enqueue_values(queue, self._cached_state_values())
+        if self._signal_router is not None:
+            self._signal_router.add(self.path, self, queue)
+            return
+        self._signal_match = self.dbus_object.connect_to_signal("PropertiesChanged",
+                                                                lambda iface, *args: self._on_properties_changed(queue, *args) if iface == DBusUnit.IFACE_UNIT else None,
+                                                                dbus_interface = DBusUnit.IFACE_PROPS)
+
+    def unregister_listener(self):
+        if self._signal_router is not None:
+            self._signal_router.remove(self.path)
+        if self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
 
     def on_change(self, callback):
         self._change_callback = callback
@@ -82,17 +241,70 @@ class DBusUnit(object):
             type_label = ""
         return "{name}{type_label}".format(name = self._name, type_label = type_label)
 
-    def _build_state(self):
-        return State(self.property('ActiveState'),
-                     self.property('SubState'),
-                     self.property('LoadState'),
-                     self.property('UnitFileState'),
-                     self.maybe_service_type)
+    def all_properties(self):
+        return self.dbus_object.GetAll(DBusUnit.IFACE_UNIT, dbus_interface=DBusUnit.IFACE_PROPS)
+
+    def _state_values(self):
+        if self.cache_properties:
+            return self._cached_state_values()
+        return tuple(self.property(p) for p in DBusUnit.STATE_PROPERTIES)
+
+    def _cached_state_values(self):
+        if any(p not in self._properties for p in DBusUnit.STATE_PROPERTIES):
+            self._properties.update(self.all_properties())
+        return tuple(self._properties[p] for p in DBusUnit.STATE_PROPERTIES)
+
+    def _merge_properties(self, changed, invalidated):
+        if changed:
+            self._properties.update(changed)
+        for p in invalidated:
+            self._properties.pop(p, None)
+
+    def _on_properties_changed(self, queue, changed = None, invalidated = ()):
+        started = profiling.now()
+        self._signals_metric.inc()
+        if self.cache_properties:
+            self._merge_properties(changed, invalidated)
+        self._enqueue_state(queue)
+        profiling.record('signal', started, self._name)
 
     def _enqueue_state(self, queue):
-        queue.put((self, self._build_state()))
+        started = profiling.now()
+        values  = self._state_values()
+        profiling.record('build_state', started, self._name)
+        self._enqueue_values(queue, values)
+
+    def _enqueue_values(self, queue, values):
+        if values == self._last_values:
+            self._states_suppressed += 1
+            self._suppressed_metric.inc()
+            return
+        self._last_values      = values
+        self._states_enqueued += 1
+        self._enqueued_metric.inc()
+        queue.put((self, State(*(values + (self.maybe_service_type,)))))
     
+    def request_service_type(self, done):
+        if self._has_service_type or not self.name.endswith('.service'):
+            self._has_service_type = True
+            done()
+            return
+
+        def reply(service_props):
+            self._maybe_service_type = service_props.get('Type')
+            self._has_service_type   = True
+            done()
+
+        def error(e):
+            logging.debug("Failed to read the service type of %s: %s", self._name, e)
+            done()
+
+        self.dbus_object.GetAll(DBusUnit.IFACE_SERVICE, dbus_interface = DBusUnit.IFACE_PROPS,
+                                reply_handler = reply, error_handler = error)
+
     def _service_type(self):
+        if not self.name.endswith('.service'):
+            return None
         service_props = self.dbus_object.GetAll(DBusUnit.IFACE_SERVICE, dbus_interface=DBusUnit.IFACE_PROPS)
         if 'Type' in service_props:
             return service_props['Type']
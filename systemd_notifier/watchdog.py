@@ -0,0 +1,82 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+def sd_notify(message):
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        s.connect(address)
+        s.sendall(message)
+        return True
+    except socket.error as e:
+        logging.warning("Failed to notify systemd (%s): %s", message.split('=')[0], e)
+        return False
+    finally:
+        s.close()
+
+def watchdog_timeout():
+    usec = os.environ.get('WATCHDOG_USEC')
+    pid  = os.environ.get('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1e6
+
+class Watchdog(object):
+
+    def __init__(self, dbus_manager, callback_managers, timeout, max_latency = 30, max_stall = None):
+        self._dbus_manager      = dbus_manager
+        self._callback_managers = callback_managers
+        self._interval          = timeout / 2.0
+        self._max_latency       = max_latency
+        self._max_stall         = self._interval if max_stall is None else max_stall
+        self._loop_beat         = time.time()
+        self._healthy           = True
+
+    def start(self):
+        self._dbus_manager.call_later(0, self._loop_tick)
+
+        t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+        logging.info("Petting the systemd watchdog every %.1fs while the pipeline is healthy"%(self._interval))
+        return self
+
+    def problems(self):
+        now      = time.time()
+        problems = []
+        if now - self._loop_beat > self._max_stall:
+            problems.append("D-Bus main loop has not run for %.1fs"%(now - self._loop_beat))
+        for manager in self._callback_managers:
+            if manager.busy_for > self._max_stall:
+                problems.append("state processing has been stuck for %.1fs"%(manager.busy_for))
+            if manager.backlog and manager.latency > self._max_latency:
+                problems.append("state queue latency is %.1fs (limit %.1fs)"%(manager.latency, self._max_latency))
+        return problems
+
+    def _loop_tick(self):
+        self._loop_beat = time.time()
+        self._dbus_manager.call_later(self._interval / 2.0, self._loop_tick)
+
+    def _run(self):
+        while True:
+            problems = self.problems()
+            if not problems:
+                if not self._healthy:
+                    logging.info("Event pipeline recovered; resuming watchdog")
+                    sd_notify("STATUS=Monitoring")
+                self._healthy = True
+                sd_notify("WATCHDOG=1")
+            else:
+                if self._healthy:
+                    logging.error("Withholding watchdog: %s", "; ".join(problems))
+                    sd_notify("STATUS=Stalled: %s"%("; ".join(problems)))
+                self._healthy = False
+            time.sleep(self._interval)